@@ -3,7 +3,7 @@ import numpy as np
 from sklearn.metrics.pairwise import cosine_similarity
 from sklearn.preprocessing import MultiLabelBinarizer
 from sklearn.model_selection import train_test_split  # Import train_test_split
-from collections import defaultdict
+from scipy.sparse import csr_matrix
 
 
 # Load Data
@@ -89,31 +89,30 @@ def collaborative_recommendation_user(user_id, user_similarity_df, interaction_m
         print(f"User ID {user_id} not found.")
         return pd.DataFrame(columns=['Event ID', 'Title', 'Score'])
 
-    # Get the most similar users
-    similar_users = user_similarity_df[user_id].sort_values(ascending=False).iloc[1:]  # Exclude the user themselves
-    event_scores = defaultdict(float)
+    # Similarity of every other user, in interaction_matrix row order
+    similarities = user_similarity_df.loc[user_id].reindex(interaction_matrix.index).fillna(0).to_numpy(dtype=float, copy=True)
+    similarities[interaction_matrix.index.get_loc(user_id)] = 0  # Exclude the user themselves
 
-    # Score events based on similar users
-    for similar_user, similarity in similar_users.items():
-        user_events = interaction_matrix.loc[similar_user]
-        for event_id, interaction_score in user_events.items():
-            if interaction_matrix.loc[user_id, event_id] == 0:  # Only recommend unseen events
-                event_scores[event_id] += similarity * interaction_score
+    # Similarity-weighted sum of all users' interactions as one sparse matrix-vector product
+    interactions = csr_matrix(interaction_matrix.to_numpy(dtype=float))
+    scores = interactions.T @ similarities
 
-    if not event_scores:
+    # Only recommend unseen events
+    unseen = np.flatnonzero(interaction_matrix.loc[user_id].to_numpy() == 0)
+    if len(unseen) == 0 or len(interaction_matrix.index) < 2:
         print("No recommended events found for collaborative filtering.")
         return pd.DataFrame(columns=['Event ID', 'Title', 'Score'])
+    event_ids = interaction_matrix.columns[unseen].to_numpy()
 
     # Normalize scores for consistent formatting
-    max_score = max(event_scores.values()) if event_scores else 1
-    event_scores = {k: v / max_score for k, v in event_scores.items()}
-
-    # Convert to DataFrame and sort by score
-    scored_events = pd.DataFrame(list(event_scores.items()), columns=['Event ID', 'Score'])
-    scored_events = scored_events.sort_values(by='Score', ascending=False).reset_index(drop=True)
-
-    # Select top_n events
-    scored_events = scored_events.head(top_n)
+    values = scores[unseen] / scores[unseen].max()
+
+    # Select top_n events with argpartition, then order just those
+    top = np.arange(len(values))
+    if len(values) > top_n:
+        top = np.argpartition(-values, top_n - 1)[:top_n]
+    top = top[np.lexsort((top, -values[top]))]
+    scored_events = pd.DataFrame({'Event ID': event_ids[top], 'Score': values[top]})
 
     # Fetch event details
     recommended_events = events_df[events_df['Event ID'].isin(scored_events['Event ID'])].copy()
@@ -119,7 +119,7 @@ const FaceTestingScreen = ({ route, navigation }) => {
   
       const result = await response.json();
       if (result.success) {
-        onComplete(true);
+        onComplete(true, result.token);
         Alert.alert('Success', result.message);
         navigation.goBack();
       } else {
@@ -29,6 +29,7 @@ const ManageProfile = ({ route, navigation }) => {
     const [isLoading, setIsLoading] = useState(false); // Loading state
     const [permission, requestPermission] = useCameraPermissions();
     const [isFaceDataAdded, setIsFaceDataAdded] = useState(false);
+    const [captureToken, setCaptureToken] = useState(null);
 
     useEffect(() => {
         const requestCameraPermission = async () => {
@@ -71,8 +72,9 @@ const ManageProfile = ({ route, navigation }) => {
 
         navigation.navigate('FaceTestingEditScreen', {
             email,
-            onComplete: (status) => {
+            onComplete: (status, token) => {
                 setIsFaceDataAdded(status); // Update state based on face data status
+                setCaptureToken(token); // Identifies this capture to /confirmEditFace
                 if (status) {
                     Alert.alert('Success', 'Face data added successfully!');
                 } else {
@@ -176,7 +178,7 @@ const ManageProfile = ({ route, navigation }) => {
             }
 
             // Convert data to JSON string
-            const jsonData = JSON.stringify(updatedData);
+            const jsonData = JSON.stringify({ ...updatedData, captureToken });
             console.log('JSON Data:', jsonData); // Log JSON data
 
             // Send updated data to your server
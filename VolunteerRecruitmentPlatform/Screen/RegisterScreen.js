@@ -41,6 +41,7 @@ const RegisterScreen = ({ route, navigation }) => {
   const [secretAnswer, setSecretAnswer] = useState('');
 
   const [isFaceDataAdded, setIsFaceDataAdded] = useState(false);
+  const [captureToken, setCaptureToken] = useState(null);
   const [permission, requestPermission] = useCameraPermissions();
 
   const [address, setAddress] = useState(null);
@@ -125,8 +126,9 @@ const RegisterScreen = ({ route, navigation }) => {
 
     navigation.navigate('FaceTestingScreen', {
       email,
-      onComplete: (status) => {
+      onComplete: (status, token) => {
         setIsFaceDataAdded(status); // Update state based on face data status
+        setCaptureToken(token); // Identifies this capture to /register
         if (status) {
           Alert.alert('Success', 'Face data added successfully!');
         } else {
@@ -234,7 +236,7 @@ const RegisterScreen = ({ route, navigation }) => {
             headers: {
               'Content-Type': 'application/json',
             },
-            body: JSON.stringify(userData),
+            body: JSON.stringify({ ...userData, captureToken }),
           });
 
           if (!response.ok) {
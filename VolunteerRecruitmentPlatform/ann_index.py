@@ -0,0 +1,258 @@
+import numpy as np
+from scipy.sparse import csr_matrix, issparse
+
+try:
+    import hnswlib
+except ImportError:  # optional, only needed for the 'hnsw' backend
+    hnswlib = None
+
+
+def _dense(vectors):
+    vectors = vectors.toarray() if issparse(vectors) else np.asarray(vectors)
+    return np.ascontiguousarray(vectors, dtype=np.float64)
+
+
+def _normalise_rows(vectors):
+    if issparse(vectors):
+        vectors = vectors.tocsr().astype(np.float64)
+        norms = np.sqrt(np.asarray(vectors.multiply(vectors).sum(axis=1)).ravel())
+        norms[norms == 0] = 1
+        vectors.data /= np.repeat(norms, np.diff(vectors.indptr))
+        return vectors
+    vectors = np.asarray(vectors, dtype=np.float64)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+def _row_sq_norms(vectors):
+    if issparse(vectors):
+        return np.asarray(vectors.multiply(vectors).sum(axis=1)).ravel()
+    return np.einsum('ij,ij->i', vectors, vectors)
+
+
+def _dot(a, b):
+    """a @ b.T as a dense array, for any mix of sparse and dense rows."""
+    product = a @ b.T
+    return product.toarray() if issparse(product) else np.asarray(product)
+
+
+def smallest_k(distances, k):
+    """Row-wise k smallest distances and their column indices, nearest first."""
+    k = min(k, distances.shape[1])
+    candidates = np.argpartition(distances, k - 1, axis=1)[:, :k]
+    order = np.argsort(np.take_along_axis(distances, candidates, axis=1), axis=1)
+    indices = np.take_along_axis(candidates, order, axis=1)
+    return np.take_along_axis(distances, indices, axis=1), indices
+
+
+class ExactIndex:
+    """Brute-force k-NN in NumPy/SciPy, the reference the approximate backends are measured against.
+
+    metric is 'cosine' (distance 1 - cosine similarity, sparse input allowed)
+    or 'euclidean'. Queries run in blocks so memory stays block_size x n.
+    """
+
+    def __init__(self, metric='cosine', block_size=2048):
+        self.metric = metric
+        self.block_size = block_size
+        self._vectors = None
+        self._sq_norms = None
+
+    def fit(self, vectors):
+        if self.metric == 'cosine':
+            self._vectors = _normalise_rows(vectors)
+        else:
+            self._vectors = _dense(vectors)
+            self._sq_norms = np.einsum('ij,ij->i', self._vectors, self._vectors)
+        return self
+
+    def __len__(self):
+        return 0 if self._vectors is None else self._vectors.shape[0]
+
+    def _distances(self, queries):
+        if self.metric == 'cosine':
+            sims = queries @ self._vectors.T
+            sims = sims.toarray() if issparse(sims) else np.asarray(sims)
+            return np.clip(1.0 - sims, 0.0, 2.0)
+        sq = np.einsum('ij,ij->i', queries, queries)[:, None] - 2 * queries @ self._vectors.T + self._sq_norms[None, :]
+        return np.sqrt(np.maximum(sq, 0.0))
+
+    def kneighbors(self, queries, n_neighbors=5):
+        """Returns (distances, indices), nearest first, like sklearn's kneighbors."""
+        queries = _normalise_rows(queries) if self.metric == 'cosine' else _dense(queries)
+        all_distances, all_indices = [], []
+        for start in range(0, queries.shape[0], self.block_size):
+            distances, indices = smallest_k(self._distances(queries[start:start + self.block_size]), n_neighbors)
+            all_distances.append(distances)
+            all_indices.append(indices)
+        return np.vstack(all_distances), np.vstack(all_indices)
+
+
+class IVFIndex:
+    """Inverted-file index: k-means cells, queries scan only the n_probe closest cells.
+
+    n_lists (default ~sqrt(n)) and n_probe trade recall for latency; n_probe
+    equal to n_lists is exact. Sparse input stays sparse: only the centroids
+    are dense, and assignments run block_size rows at a time.
+    """
+
+    def __init__(self, metric='cosine', n_lists=None, n_probe=8, n_iter=10, seed=0, block_size=2048):
+        self.metric = metric
+        self.n_lists = n_lists
+        self.n_probe = int(n_probe)
+        self.n_iter = int(n_iter)
+        self.seed = int(seed)
+        self.block_size = int(block_size)
+        self._vectors = None
+        self._sq_norms = None
+        self._centroids = None
+        self._lists = []
+
+    def _prepare(self, vectors):
+        if self.metric == 'cosine':
+            return _normalise_rows(vectors)
+        return vectors.tocsr().astype(np.float64) if issparse(vectors) else _dense(vectors)
+
+    def _assign(self, vectors, centroids):
+        centroid_sq = _row_sq_norms(centroids)[None, :]
+        return np.concatenate([
+            np.argmin(centroid_sq - 2 * _dot(vectors[start:start + self.block_size], centroids), axis=1)
+            for start in range(0, vectors.shape[0], self.block_size)
+        ])
+
+    def _centroids_of(self, vectors, assignment, centroids):
+        # Sum each cell's members with one (sparse) product; empty cells keep their centroid
+        members = csr_matrix((np.ones(len(assignment)), (assignment, np.arange(len(assignment)))),
+                             shape=(len(centroids), vectors.shape[0]))
+        sums = members @ vectors
+        sums = sums.toarray() if issparse(sums) else np.asarray(sums)
+        counts = np.bincount(assignment, minlength=len(centroids))
+        filled = counts > 0
+        centroids = centroids.copy()
+        centroids[filled] = sums[filled] / counts[filled, None]
+        return centroids
+
+    def fit(self, vectors):
+        vectors = self._prepare(vectors)
+        self._vectors = vectors
+        self._sq_norms = _row_sq_norms(vectors)
+        n = vectors.shape[0]
+        n_lists = min(int(self.n_lists or max(1, int(np.sqrt(n)))), n) if n else 1
+        rng = np.random.default_rng(self.seed)
+        if n:
+            centroids = vectors[rng.choice(n, n_lists, replace=False)]
+            centroids = centroids.toarray() if issparse(centroids) else np.array(centroids)
+        else:
+            centroids = np.zeros((1, vectors.shape[1]))
+        for _ in range(self.n_iter if n else 0):
+            centroids = self._centroids_of(vectors, self._assign(vectors, centroids), centroids)
+        assignment = self._assign(vectors, centroids) if n else np.array([], dtype=int)
+        self._centroids = centroids
+        self._lists = [np.flatnonzero(assignment == cell) for cell in range(len(centroids))]
+        return self
+
+    def __len__(self):
+        return self._vectors.shape[0]
+
+    def _cell_distances(self, queries, members):
+        similarities = _dot(queries, self._vectors[members])
+        if self.metric == 'cosine':
+            return np.clip(1.0 - similarities, 0.0, 2.0)
+        sq = _row_sq_norms(queries)[:, None] - 2 * similarities + self._sq_norms[members][None, :]
+        return np.sqrt(np.maximum(sq, 0.0))
+
+    def kneighbors(self, queries, n_neighbors=5):
+        queries = self._prepare(queries)
+        k = min(n_neighbors, len(self))
+        n_probe = min(self.n_probe, len(self._lists))
+        probes = np.argsort(_row_sq_norms(self._centroids)[None, :] - 2 * _dot(queries, self._centroids),
+                            axis=1)[:, :n_probe]
+
+        best_distances = np.full((queries.shape[0], k), np.inf)
+        best_indices = np.full((queries.shape[0], k), -1)
+        # Scan cell by cell, each against every query that probes it, in one product
+        for cell in np.unique(probes):
+            members = self._lists[cell]
+            rows = np.flatnonzero((probes == cell).any(axis=1))
+            if not len(members) or not len(rows):
+                continue
+            distances = np.hstack([best_distances[rows], self._cell_distances(queries[rows], members)])
+            indices = np.hstack([best_indices[rows], np.broadcast_to(members, (len(rows), len(members)))])
+            best_distances[rows], order = smallest_k(distances, k)
+            best_indices[rows] = np.take_along_axis(indices, order, axis=1)
+
+        # The probed cells held fewer than k vectors: answer those queries exactly
+        short = np.flatnonzero((best_indices < 0).any(axis=1))
+        if len(short):
+            distances = self._cell_distances(queries[short], np.arange(len(self)))
+            best_distances[short], best_indices[short] = smallest_k(distances, k)
+        return best_distances, best_indices
+
+
+class HNSWIndex:
+    """Hierarchical navigable small-world graph via hnswlib (optional dependency).
+
+    M and ef_construction shape the graph; ef is the query-time recall/latency knob.
+    Sparse input is densified block_size rows at a time as it is added, but
+    hnswlib itself keeps every vector dense (n x dim float32), so for wide
+    sparse matrices such as users x events the 'ivf' backend uses far less memory.
+    """
+
+    def __init__(self, metric='cosine', M=16, ef_construction=200, ef=64, threads=1, block_size=2048):
+        if hnswlib is None:
+            raise ImportError("hnswlib is not installed; pip install hnswlib to use the 'hnsw' backend")
+        self.block_size = int(block_size)
+        self.metric = metric
+        self.M = int(M)
+        self.ef_construction = int(ef_construction)
+        self.ef = int(ef)
+        self.threads = int(threads)
+        self._index = None
+        self._size = 0
+
+    def fit(self, vectors):
+        self._size = vectors.shape[0]
+        self._index = hnswlib.Index(space='cosine' if self.metric == 'cosine' else 'l2', dim=vectors.shape[1])
+        self._index.init_index(max_elements=max(self._size, 1), ef_construction=self.ef_construction, M=self.M)
+        for start in range(0, self._size, self.block_size):
+            block = _dense(vectors[start:start + self.block_size]).astype(np.float32)
+            self._index.add_items(block, np.arange(start, start + len(block)), num_threads=self.threads)
+        self._index.set_ef(self.ef)
+        return self
+
+    def __len__(self):
+        return self._size
+
+    def kneighbors(self, queries, n_neighbors=5):
+        k = min(n_neighbors, self._size)
+        self._index.set_ef(max(self.ef, k))
+        indices, distances = self._index.knn_query(_dense(queries).astype(np.float32), k=k, num_threads=self.threads)
+        distances = distances.astype(np.float64)
+        if self.metric != 'cosine':
+            distances = np.sqrt(np.maximum(distances, 0.0))  # hnswlib returns squared L2
+        return distances, indices.astype(int)
+
+
+BACKENDS = {
+    'exact': ExactIndex,
+    'ivf': IVFIndex,
+    'hnsw': HNSWIndex,
+}
+
+
+def make_index(spec='exact', metric='cosine'):
+    """Builds an index from a spec such as 'exact', 'ivf:n_lists=64,n_probe=8' or 'hnsw:ef=128'.
+
+    Falls back to the exact index when the requested backend is unavailable.
+    """
+    backend, _, options = (spec or 'exact').partition(':')
+    params = {}
+    for option in filter(None, options.split(',')):
+        key, _, value = option.partition('=')
+        params[key.strip()] = float(value) if '.' in value else int(value)
+    try:
+        return BACKENDS[backend.strip()](metric=metric, **params)
+    except (KeyError, ImportError) as e:
+        print(f"⚠️ ANN backend '{spec}' unavailable ({e}), using exact search.")
+        return ExactIndex(metric=metric)
@@ -0,0 +1,83 @@
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+from ann_index import ExactIndex, make_index
+from interaction_matrix import InteractionMatrix
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'RecommendationEngine'))
+import fakedata  # noqa: E402
+
+
+def interaction_vectors(num_users, num_events, num_interactions):
+    """User x event matrix built from fakedata.py's generators, scaled up."""
+    users = fakedata.generate_users(num_users)
+    events = fakedata.generate_events(num_events)
+    interactions = fakedata.generate_user_interactions(users, events, num_interactions)
+    store = InteractionMatrix(window_days=28)
+    store.load([
+        {'User ID': f"IN{i}", 'userId': row['User ID'], 'eventId': row['Event ID'],
+         'type': row['Type'], 'timestamp': row['Timestamp']}
+        for i, row in enumerate(interactions)
+    ])
+    matrix, _, _ = store.matrix()
+    return matrix
+
+
+def face_vectors(num_identities, shots, dim, seed=0):
+    """Enrollment-like embeddings: a few noisy shots around one centre per identity."""
+    rng = np.random.default_rng(seed)
+    centres = rng.normal(size=(num_identities, dim))
+    vectors = np.repeat(centres, shots, axis=0) + 0.35 * rng.normal(size=(num_identities * shots, dim))
+    queries = centres + 0.35 * rng.normal(size=centres.shape)
+    return vectors, queries
+
+
+def run(name, vectors, queries, metric, specs, k):
+    exact = ExactIndex(metric=metric).fit(vectors)
+    started = time.perf_counter()
+    _, truth = exact.kneighbors(queries, k)
+    exact_qps = queries.shape[0] / (time.perf_counter() - started)
+    print(f"\n{name}: {vectors.shape[0]} vectors x {vectors.shape[1]} dims, {queries.shape[0]} queries, k={k}")
+    print(f"{'backend':32} {'build s':>8} {'recall@k':>9} {'QPS':>10}")
+    print(f"{'exact (reference)':32} {'-':>8} {1.0:9.3f} {exact_qps:10.0f}")
+
+    for spec in specs:
+        index = make_index(spec, metric=metric)
+        started = time.perf_counter()
+        index.fit(vectors)
+        build_seconds = time.perf_counter() - started
+        started = time.perf_counter()
+        _, found = index.kneighbors(queries, k)
+        qps = queries.shape[0] / (time.perf_counter() - started)
+        recall = np.mean([len(set(a) & set(b)) / len(a) for a, b in zip(truth, found)])
+        print(f"{spec:32} {build_seconds:8.2f} {recall:9.3f} {qps:10.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Recall and QPS of the ANN backends against exact search.')
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--events', type=int, default=500)
+    parser.add_argument('--interactions', type=int, default=200000)
+    parser.add_argument('--identities', type=int, default=5000)
+    parser.add_argument('--shots', type=int, default=4)
+    parser.add_argument('--dim', type=int, default=2622)
+    parser.add_argument('--queries', type=int, default=1000)
+    parser.add_argument('-k', type=int, default=5)
+    parser.add_argument('--specs', nargs='+',
+                        default=['ivf:n_probe=4', 'ivf:n_probe=16', 'hnsw:ef=32', 'hnsw:ef=128'])
+    args = parser.parse_args()
+
+    matrix = interaction_vectors(args.users, args.events, args.interactions)
+    rows = np.random.default_rng(0).choice(matrix.shape[0], min(args.queries, matrix.shape[0]), replace=False)
+    run('user-user (cosine)', matrix, matrix[rows], 'cosine', args.specs, args.k)
+
+    vectors, queries = face_vectors(args.identities, args.shots, args.dim)
+    run('face embeddings (euclidean)', vectors, queries[:args.queries], 'euclidean', args.specs, args.k)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+import argparse
+import time
+
+import numpy as np
+
+from face_index import FaceIndex, l2_normalise
+from face_store import FaceEmbeddingStore
+
+THRESHOLD = 0.57  # mark_attendance's acceptance distance
+
+
+def synthetic_split(identities, shots, dim, noise, spread, seed=0):
+    """Enrollment-like embeddings: shots per identity plus one held-out shot each, and impostors.
+
+    Identities share a common face direction (spread sets how far apart they
+    are) and each shot gets its own noise level, like varying pose and light.
+    Every tenth identity is never enrolled; its held-out shot is an impostor query.
+    """
+    rng = np.random.default_rng(seed)
+    common = l2_normalise(rng.normal(size=(1, dim)))
+    centres = l2_normalise(common + spread * rng.normal(size=(identities, dim)) / np.sqrt(dim))
+
+    def shot(centre, count):
+        scale = noise * rng.uniform(0.5, 1.5, size=(count, 1))
+        return l2_normalise(centre + scale * rng.normal(size=(count, dim)) / np.sqrt(dim))
+
+    gallery, labels, queries, truth, impostors = [], [], [], [], []
+    for i, centre in enumerate(centres):
+        label = f"volunteer{i}@example.com"
+        if i % 10 == 9:
+            impostors.append(shot(centre, 1))
+            continue
+        gallery.append(shot(centre, shots))
+        labels.extend([label] * shots)
+        queries.append(shot(centre, 1))
+        truth.append(label)
+    return np.vstack(gallery), labels, np.vstack(queries), truth, np.vstack(impostors)
+
+
+def store_split(directory):
+    """The same split over real embeddings: each identity's last shot is held out, every tenth identity is an impostor."""
+    vectors, labels = FaceEmbeddingStore(directory).live_embeddings()
+    rows_by_label = {}
+    for row, label in enumerate(labels):
+        rows_by_label.setdefault(label, []).append(row)
+
+    gallery, queries, truth, impostors = [], [], [], []
+    for i, (label, rows) in enumerate(rows_by_label.items()):
+        if i % 10 == 9:
+            impostors.append(rows[-1])
+        elif len(rows) > 1:
+            gallery.extend(rows[:-1])
+            queries.append(rows[-1])
+            truth.append(label)
+    return vectors[gallery], [labels[row] for row in gallery], vectors[queries], truth, vectors[impostors]
+
+
+def evaluate(name, index, queries, truth, impostors, reference=None):
+    started = time.perf_counter()
+    results = [index.recognise(query) for query in queries]
+    scan_ms = 1000 * (time.perf_counter() - started) / len(queries)
+    rejected = [index.recognise(query) for query in impostors]
+
+    accepted = [r['label'] if r['distance'] < THRESHOLD else None for r in results]
+    accuracy = np.mean([label == expected for label, expected in zip(accepted, truth)])
+    false_accepts = np.mean([r['distance'] < THRESHOLD for r in rejected]) if len(rejected) else 0.0
+    agreement = np.mean([a == b for a, b in zip(accepted, reference)]) if reference else 1.0
+    print(f"{name:24} {accuracy:9.3f} {false_accepts:8.3f} {agreement:10.3f} {scan_ms:9.2f} "
+          f"{index.memory_bytes() / 2 ** 20:9.1f}")
+    return accepted
+
+
+def build_index(gallery, labels, prototypes=None, shortlist=10, precision='float32', rerank=None):
+    index = FaceIndex(prototypes=prototypes, shortlist=shortlist, precision=precision, rerank=rerank)
+    index.add_rows(gallery, labels)
+    return index
+
+
+def exact_source(gallery, labels):
+    """label -> float32 embeddings, standing in for FaceEmbeddingStore.embeddings_of."""
+    rows_by_label = {}
+    for row, label in enumerate(labels):
+        rows_by_label.setdefault(label, []).append(row)
+    return lambda label: gallery[rows_by_label.get(label, [])]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Accuracy, latency and memory of prototype search and quantised galleries '
+                    'against the full float32 gallery on held-out embeddings.')
+    parser.add_argument('--store', help='face store directory with real embeddings (default: synthetic data)')
+    parser.add_argument('--identities', type=int, default=5000)
+    parser.add_argument('--shots', type=int, default=5)
+    parser.add_argument('--dim', type=int, default=2622)
+    parser.add_argument('--noise', type=float, default=0.4)
+    parser.add_argument('--spread', type=float, default=0.3)
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--modes', nargs='+', default=['centroid', 'medoid:2'])
+    parser.add_argument('--shortlist', type=int, nargs='+', default=[5, 10])
+    args = parser.parse_args()
+
+    if args.store:
+        gallery, labels, queries, truth, impostors = store_split(args.store)
+    else:
+        gallery, labels, queries, truth, impostors = synthetic_split(args.identities, args.shots, args.dim,
+                                                                     args.noise, args.spread)
+    queries, truth = queries[:args.queries], truth[:args.queries]
+    impostors = impostors[:args.queries]
+    print(f"{len(gallery)} gallery embeddings, {len(set(labels))} identities, "
+          f"{len(queries)} held-out queries, {len(impostors)} impostors, threshold {THRESHOLD}")
+    print(f"{'mode':24} {'accuracy':>9} {'false acc':>8} {'agreement':>10} {'ms/scan':>9} {'MB':>9}")
+
+    reference = evaluate('all embeddings', build_index(gallery, labels), queries, truth, impostors)
+    for mode in args.modes:
+        for shortlist in args.shortlist:
+            index = build_index(gallery, labels, mode, shortlist)
+            evaluate(f"{mode} top-{shortlist}", index, queries, truth, impostors, reference)
+    rerank = exact_source(l2_normalise(gallery), labels)
+    evaluate('int8', build_index(gallery, labels, precision='int8'), queries, truth, impostors, reference)
+    evaluate('int8 + re-rank', build_index(gallery, labels, precision='int8', rerank=rerank),
+             queries, truth, impostors, reference)
+    # Prototypes alone hold more than the full gallery; with int8 rows they hold less
+    for mode in args.modes:
+        shortlist = max(args.shortlist)
+        index = build_index(gallery, labels, mode, shortlist, precision='int8', rerank=rerank)
+        evaluate(f"{mode} top-{shortlist} int8", index, queries, truth, impostors, reference)
+
+
+if __name__ == '__main__':
+    main()
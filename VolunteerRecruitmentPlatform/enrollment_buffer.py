@@ -0,0 +1,91 @@
+import os
+import secrets
+import sqlite3
+import time
+from contextlib import closing
+
+import numpy as np
+
+
+class EnrollmentBuffer:
+    """Captured enrollment embeddings waiting for /register or /confirmEditFace.
+
+    Each capture is staged under a random token, alongside its email and
+    purpose ('register' or 'edit'), in a local SQLite file, so every thread and
+    worker process on the box sees the same captures and a capture is taken
+    exactly once. A new capture replaces the email's previous one for the same
+    purpose. Captures expire after ttl_seconds, and once the staged embeddings
+    pass max_bytes the oldest captures are dropped.
+    """
+
+    def __init__(self, path='data/enrollment_buffer.db', ttl_seconds=1800, max_bytes=64 * 1024 * 1024):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with closing(self._connect()) as db:
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('CREATE TABLE IF NOT EXISTS captures (token TEXT PRIMARY KEY, email TEXT NOT NULL, '
+                       'purpose TEXT NOT NULL, created REAL NOT NULL, dim INTEGER NOT NULL, embeddings BLOB NOT NULL)')
+            db.execute('CREATE INDEX IF NOT EXISTS captures_by_email ON captures (email, purpose)')
+
+    def _connect(self):
+        # Autocommit connection per call; writes take the lock explicitly with BEGIN IMMEDIATE
+        return sqlite3.connect(self.path, timeout=10, isolation_level=None)
+
+    def put(self, email, purpose, embeddings):
+        """Stages embeddings for email and returns the capture token."""
+        embeddings = np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+        token = secrets.token_urlsafe(16)
+        with closing(self._connect()) as db:
+            db.execute('BEGIN IMMEDIATE')
+            db.execute('DELETE FROM captures WHERE (email = ? AND purpose = ?) OR created < ?',
+                       (email, purpose, time.time() - self.ttl_seconds))
+            db.execute('INSERT INTO captures VALUES (?, ?, ?, ?, ?, ?)',
+                       (token, email, purpose, time.time(), embeddings.shape[1], embeddings.tobytes()))
+            self._enforce_cap(db)
+            db.execute('COMMIT')
+        return token
+
+    def _enforce_cap(self, db):
+        total = db.execute('SELECT COALESCE(SUM(LENGTH(embeddings)), 0) FROM captures').fetchone()[0]
+        for token, size in db.execute('SELECT token, LENGTH(embeddings) FROM captures ORDER BY created').fetchall():
+            if total <= self.max_bytes:
+                break
+            db.execute('DELETE FROM captures WHERE token = ?', (token,))
+            total -= size
+            print(f"⚠️ Enrollment buffer over {self.max_bytes} bytes, dropped the oldest capture.")
+
+    def take(self, purpose, token=None, email=None):
+        """Removes and returns (email, embeddings) of a live capture, or None.
+
+        Looks the capture up by token, else by email (for clients that do not
+        send the token yet).
+        """
+        with closing(self._connect()) as db:
+            db.execute('BEGIN IMMEDIATE')
+            if token:
+                row = db.execute('SELECT token, email, dim, embeddings FROM captures '
+                                 'WHERE token = ? AND purpose = ? AND created >= ?',
+                                 (token, purpose, time.time() - self.ttl_seconds)).fetchone()
+            else:
+                row = db.execute('SELECT token, email, dim, embeddings FROM captures '
+                                 'WHERE email = ? AND purpose = ? AND created >= ? ORDER BY created DESC',
+                                 (email, purpose, time.time() - self.ttl_seconds)).fetchone()
+            if row is not None:
+                db.execute('DELETE FROM captures WHERE token = ?', (row[0],))
+            db.execute('COMMIT')
+        if row is None:
+            return None
+        _, email, dim, data = row
+        return email, np.frombuffer(data, dtype=np.float32).reshape(-1, dim)
+
+    def purge(self):
+        """Deletes expired captures; returns how many."""
+        with closing(self._connect()) as db:
+            return db.execute('DELETE FROM captures WHERE created < ?', (time.time() - self.ttl_seconds,)).rowcount
+
+    def stats(self):
+        with closing(self._connect()) as db:
+            count, size = db.execute('SELECT COUNT(*), COALESCE(SUM(LENGTH(embeddings)), 0) FROM captures').fetchone()
+        return {'captures': count, 'bytes': size, 'max_bytes': self.max_bytes, 'ttl_seconds': self.ttl_seconds}
@@ -0,0 +1,72 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class EventGalleries:
+    """Attendance galleries scoped to one event's participants, cached per event.
+
+    A gallery is a small FaceIndex holding only the participants' embeddings,
+    so a scan searches tens of faces instead of every registered volunteer and
+    cannot match someone who is not at the event. Participants come from a
+    roster passed with the request or from resolve_participants(event_id).
+
+    A cached gallery is rebuilt when the face index changes, when a different
+    roster is passed, after invalidate(event_id), or once ttl_seconds have
+    passed since its participants were resolved. At most max_events are kept.
+    """
+
+    def __init__(self, face_index, resolve_participants=None, ttl_seconds=300, max_events=128):
+        self.face_index = face_index
+        self.resolve_participants = resolve_participants
+        self.ttl_seconds = ttl_seconds
+        self.max_events = max_events
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.builds = 0
+
+    def get(self, event_id, roster=None):
+        """The gallery for event_id; roster (emails) overrides resolve_participants."""
+        with self._lock:
+            entry = self._entries.get(event_id)
+            if entry is not None and self._is_current(entry, roster):
+                self._entries.move_to_end(event_id)
+                self.hits += 1
+                return entry['gallery']
+
+        if roster is not None:
+            participants = frozenset(roster)
+        elif self.resolve_participants is not None:
+            participants = frozenset(self.resolve_participants(event_id))
+        else:
+            raise ValueError('A roster is required to scope attendance to an event')
+
+        version = self.face_index.version
+        entry = {'participants': participants, 'roster': roster is not None, 'version': version,
+                 'built_at': time.monotonic(), 'gallery': self.face_index.subset(participants)}
+        with self._lock:
+            self._entries[event_id] = entry
+            self._entries.move_to_end(event_id)
+            while len(self._entries) > self.max_events:
+                self._entries.popitem(last=False)
+            self.builds += 1
+        return entry['gallery']
+
+    def _is_current(self, entry, roster):
+        if entry['version'] != self.face_index.version:
+            return False
+        if roster is not None:
+            return entry['roster'] and entry['participants'] == frozenset(roster)
+        return not entry['roster'] and time.monotonic() - entry['built_at'] < self.ttl_seconds
+
+    def invalidate(self, event_id=None):
+        with self._lock:
+            if event_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(event_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {'events': len(self._entries), 'hits': self.hits, 'builds': self.builds}
@@ -0,0 +1,105 @@
+import hashlib
+import os
+import pickle
+import threading
+from collections import namedtuple
+
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+
+def event_titles(events_df):
+    return events_df['title'].tolist() if 'title' in events_df else [None] * len(events_df)
+
+
+def content_signature(events_df):
+    """Hashes the (eventId, title, content_features) rows that the index is built from."""
+    digest = hashlib.sha1()
+    rows = zip(events_df['eventId'], event_titles(events_df), events_df['content_features'])
+    for event_id, title, content in sorted(rows, key=lambda row: str(row[0])):
+        digest.update(f"{event_id}\x1f{title}\x1f{content}\x1e".encode('utf-8'))
+    return digest.hexdigest()
+
+
+class EventIndexState(namedtuple('EventIndexState', 'signature vectorizer matrix event_ids titles row_of')):
+    """One fitted index: callers keep the state ensure() returned, so a concurrent refit cannot mix two fits."""
+
+    def transform(self, texts):
+        return self.vectorizer.transform(texts)
+
+    def score(self, query_tfidf):
+        """Cosine similarity of L2-normalised query rows against every event row."""
+        return (query_tfidf @ self.matrix.T).toarray()
+
+
+def make_state(signature, vectorizer, matrix, event_ids, titles):
+    return EventIndexState(signature, vectorizer, matrix, event_ids, titles,
+                           {event_id: row for row, event_id in enumerate(event_ids)})
+
+
+class EventContentIndex:
+    """TF-IDF index over upcoming events, fitted once and persisted to disk.
+
+    The fitted vectorizer, the L2-normalised sparse event matrix, the event
+    ids, titles and an eventId -> row map live together in one immutable
+    EventIndexState. It is refitted only when the set of upcoming events (or
+    their titles or content) changes; a restarted worker loads the pickled
+    index instead.
+    """
+
+    def __init__(self, path='data/event_index.pkl'):
+        self.path = path
+        self.state = None
+        self._source = None
+        self._lock = threading.Lock()
+
+    def ensure(self, events, prepare):
+        """The EventIndexState matching events; prepare(events) returns the content DataFrame."""
+        with self._lock:
+            # Same snapshot object as last time, nothing can have changed
+            if events is self._source:
+                return self.state
+            events_df = prepare(events)
+            signature = content_signature(events_df)
+            if self.state is None or signature != self.state.signature:
+                state = self._load(signature)
+                if state is None:
+                    state = self._fit(events_df, signature)
+                    self.save(state)
+                self.state = state
+            self._source = events
+            return self.state
+
+    def _fit(self, events_df, signature):
+        vectorizer = TfidfVectorizer(stop_words='english')
+        matrix = vectorizer.fit_transform(events_df['content_features']).tocsr()
+        state = make_state(signature, vectorizer, matrix, events_df['eventId'].tolist(), event_titles(events_df))
+        print(f"✅ Event index fitted on {len(state.event_ids)} events.")
+        return state
+
+    def _load(self, signature):
+        """The pickled state if it was fitted on signature, else None."""
+        if not os.path.exists(self.path):
+            return None
+        try:
+            with open(self.path, 'rb') as f:
+                saved = pickle.load(f)
+        except Exception as e:
+            print(f"⚠️ Could not load event index: {e}")
+            return None
+        if saved.get('signature') != signature:
+            return None
+        print("✅ Event index loaded from disk.")
+        return make_state(signature, saved['vectorizer'], saved['matrix'], saved['event_ids'], saved['titles'])
+
+    def save(self, state):
+        saved = {
+            'signature': state.signature,
+            'vectorizer': state.vectorizer,
+            'matrix': state.matrix,
+            'event_ids': state.event_ids,
+            'titles': state.titles,
+        }
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(saved, f)
+        os.replace(tmp_path, self.path)
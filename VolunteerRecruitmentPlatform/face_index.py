@@ -0,0 +1,527 @@
+import os
+import pickle
+import threading
+import time
+
+import numpy as np
+
+from ann_index import make_index, smallest_k
+
+
+def l2_normalise(vectors):
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+def quantise(vectors, precision):
+    """(codes, per-row scales) for L2-normalised float32 vectors; codes * scales approximates them.
+
+    'int8' quarters the memory of float32, scaling each row so its largest
+    component maps to 127. float16 is not offered: NumPy upcasts half floats
+    element by element, so its scans ran 5-6x slower than float32.
+    """
+    if precision == 'int8':
+        scales = np.abs(vectors).max(axis=1) / 127
+        scales[scales == 0] = 1
+        return np.round(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+    return vectors.astype(precision), np.ones(len(vectors), dtype=np.float32)
+
+
+def prototypes_of(vectors, mode):
+    """Representative vectors for one identity's embeddings.
+
+    'centroid' is their mean; 'medoid:m' picks up to m of the embeddings
+    greedily, each time the one that most reduces every embedding's distance
+    to its closest pick.
+    """
+    if mode == 'centroid':
+        return vectors.mean(axis=0, keepdims=True)
+    count = int(mode.partition(':')[2] or 1)
+    distances = np.sqrt(np.maximum(2.0 - 2.0 * vectors @ vectors.T, 0.0))
+    chosen = [int(np.argmin(distances.sum(axis=1)))]
+    while len(chosen) < min(count, len(vectors)):
+        closest = distances[:, chosen].min(axis=1)
+        gains = np.maximum(closest[:, None] - distances, 0.0).sum(axis=0)
+        gains[chosen] = -1
+        chosen.append(int(np.argmax(gains)))
+    return vectors[chosen]
+
+
+class FaceIndex:
+    """k-NN gallery of face embeddings that is updated in place, one identity at a time.
+
+    Adding an identity appends its rows (amortised O(new rows)) and removing one
+    tombstones them, so a registration is searchable as soon as add() returns.
+    Tombstoned rows are compacted away in the background. With an approximate
+    backend spec (see ann_index.make_index) the ANN structure covers the rows
+    present at its last build, rows added since are scanned exactly, and it is
+    rebuilt in the background once that tail passes rebuild_ratio of the gallery.
+
+    Embeddings are kept L2-normalised in float32, so the Euclidean distance
+    between two of them is sqrt(2 - 2 * dot product).
+
+    With prototypes ('centroid' or 'medoid:m') a second, per-identity index
+    of prototypes is kept in step; recognise() then shortlists identities by
+    prototype and re-ranks only those identities' raw embeddings. The
+    prototypes are held on top of the raw rows, at the same precision, so
+    they cut the rows a scan reads but add to memory unless paired with int8.
+
+    precision 'int8' (exact spec only) keeps the gallery quantised, see
+    quantise(); scans upcast scan_block rows at a time. With
+    rerank, a callable giving an identity's full-precision embeddings (such
+    as FaceEmbeddingStore.embeddings_of), recognise() re-ranks the shortlist
+    identities' embeddings exactly.
+    """
+
+    def __init__(self, n_neighbors=5, spec='exact', rebuild_ratio=0.1, min_rebuild_rows=64,
+                 prototypes=None, shortlist=10, precision='float32', rerank=None, scan_block=128):
+        if precision not in ('float32', 'int8'):
+            raise ValueError(f"Unknown face index precision {precision!r}")
+        if precision != 'float32' and (spec or 'exact') != 'exact':
+            raise ValueError('A quantised face index needs the exact backend')
+        self.precision = precision
+        self.rerank = rerank
+        self.scan_block = scan_block
+        self.n_neighbors = n_neighbors
+        self.prototypes = prototypes or None
+        self.shortlist = shortlist
+        self._prototypes = FaceIndex(n_neighbors=1, precision=precision) if self.prototypes else None
+        self.spec = spec or 'exact'
+        self.rebuild_ratio = rebuild_ratio
+        self.min_rebuild_rows = min_rebuild_rows
+        self.store_version = None
+        self.version = 0  # bumped by every add/remove, so derived galleries know when to rebuild
+        self._lock = threading.RLock()
+        self._sync_lock = threading.Lock()
+        self._rebuilding = False
+        self._save_pending = False
+        self._save_path = None
+        self._reset()
+
+    def _reset(self, dim=0, capacity=0):
+        self.labels = []
+        self._vectors = np.zeros((capacity, dim), dtype=self.precision)
+        self._scales = np.ones(capacity, dtype=np.float32)
+        self._alive = np.zeros(capacity, dtype=bool)
+        self._rows_by_label = {}
+        self._size = 0
+        self._max_rows = 0  # most rows any identity has had, bounds how deep recognise() searches
+        self._ann = None
+        self._ann_rows = 0
+        self._compactions = getattr(self, '_compactions', 0) + 1
+
+    def __len__(self):
+        return sum(len(rows) for rows in self._rows_by_label.values())
+
+    def __contains__(self, label):
+        return label in self._rows_by_label
+
+    def _reserve(self, rows, dim):
+        if not self._size and self._vectors.shape[1] != dim:
+            self._reset(dim, max(rows, 16))
+        if self._vectors.shape[1] != dim:
+            raise ValueError(f"Embedding size {dim} does not match the index's {self._vectors.shape[1]}")
+        needed = self._size + rows
+        if needed <= len(self._vectors):
+            return
+        capacity = max(needed, 2 * len(self._vectors))
+        # Searches hold views of the old buffers, so grow into new ones rather than resizing in place
+        for name in ('_vectors', '_scales', '_alive'):
+            old = getattr(self, name)
+            grown = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            grown[:self._size] = old[:self._size]
+            setattr(self, name, grown)
+
+    def add(self, label, embeddings):
+        """Appends embeddings for label; searchable as soon as this returns."""
+        embeddings = np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+        self.add_rows(embeddings, [label] * len(embeddings))
+
+    def add_rows(self, embeddings, labels):
+        """Appends embeddings with one label per row."""
+        if not len(labels):
+            return
+        with self._lock:
+            embeddings = l2_normalise(embeddings)
+            self._reserve(len(embeddings), embeddings.shape[1])
+            start = self._size
+            self._vectors[start:start + len(labels)], self._scales[start:start + len(labels)] = \
+                quantise(embeddings, self.precision)
+            self._alive[start:start + len(labels)] = True
+            for row, label in enumerate(labels, start=start):
+                rows = self._rows_by_label.setdefault(label, [])
+                rows.append(row)
+                self._max_rows = max(self._max_rows, len(rows))
+            self.labels.extend(labels)
+            self._size += len(labels)
+            self.version += 1
+            if self._prototypes is not None:
+                self._update_prototypes(dict.fromkeys(labels))
+            self._maybe_rebuild()
+
+    def _update_prototypes(self, labels):
+        vectors, owners = [], []
+        for label in labels:
+            self._prototypes.remove(label)
+            prototypes = prototypes_of(self._float_rows(self._rows_by_label[label]), self.prototypes)
+            vectors.append(prototypes)
+            owners.extend([label] * len(prototypes))
+        self._prototypes.add_rows(np.vstack(vectors), owners)
+
+    def remove(self, label):
+        """Tombstones every row of label; returns how many were removed."""
+        with self._lock:
+            rows = self._rows_by_label.pop(label, [])
+            self._alive[rows] = False
+            self.version += 1
+            if self._prototypes is not None:
+                self._prototypes.remove(label)
+            self._maybe_rebuild()
+            return len(rows)
+
+    def replace(self, label, embeddings):
+        with self._lock:
+            self.remove(label)
+            self.add(label, embeddings)
+
+    def _float_rows(self, rows):
+        """float32 embeddings of rows (indices or a slice), dequantised."""
+        return self._vectors[rows].astype(np.float32) * self._scales[rows, None]
+
+    def memory_bytes(self):
+        """Bytes the gallery's live and tombstoned rows take, scales included for int8, plus the prototype index."""
+        scales = self._scales[:self._size].nbytes if self.precision == 'int8' else 0
+        prototypes = self._prototypes.memory_bytes() if self._prototypes is not None else 0
+        return self._vectors[:self._size].nbytes + scales + prototypes
+
+    def _build(self, vectors, labels):
+        """A new gallery with this one's settings holding only vectors, built without taking this index's lock."""
+        fresh = FaceIndex(n_neighbors=self.n_neighbors, prototypes=self.prototypes, shortlist=self.shortlist,
+                          precision=self.precision)
+        fresh.add_rows(vectors, labels)
+        return fresh
+
+    def _swap_in(self, fresh):
+        # Caller holds the lock
+        for name in ('labels', '_vectors', '_scales', '_alive', '_rows_by_label', '_size', '_max_rows',
+                     '_prototypes'):
+            setattr(self, name, getattr(fresh, name))
+        self._ann, self._ann_rows = None, 0
+        self._compactions += 1
+
+    def reload(self, vectors, labels):
+        """Replaces the whole gallery; the new rows are built first and swapped in at once."""
+        fresh = self._build(vectors, labels)
+        with self._lock:
+            self._swap_in(fresh)
+            self.version += 1
+            self._maybe_rebuild()
+
+    def sync(self, store):
+        """Applies the store's writes since store_version, made by this or any other process.
+
+        Returns True if the gallery changed. Records are applied together under
+        the lock, so a scan never sees half of a replace; after a store
+        compaction the gallery is reloaded from the store and swapped in whole.
+        """
+        with self._sync_lock:
+            version, records = store.changes_since(self.store_version)
+            if records is None:
+                version, vectors, labels = store.snapshot()
+                self.reload(vectors, labels)
+            with self._lock:
+                for record in records or []:
+                    if record['op'] == 'add':
+                        self.add_rows(record['embeddings'], record['labels'])
+                    else:
+                        self.remove(record['label'])
+                self.store_version = version
+            return records is None or bool(records)
+
+    def _maybe_rebuild(self):
+        if self._rebuilding or not self._size:
+            return
+        dead = self._size - len(self)
+        stale = self.spec != 'exact' and \
+            self._size - self._ann_rows > max(self.min_rebuild_rows, self.rebuild_ratio * self._size)
+        if stale or (self._size >= self.min_rebuild_rows and dead > self._size / 2):
+            self._rebuilding = True
+            threading.Thread(target=self._rebuild, name='face-index-rebuild', daemon=True).start()
+
+    def _needs_compaction(self):
+        with self._lock:
+            return self._size >= self.min_rebuild_rows and self._size - len(self) > self._size / 2
+
+    def _compact(self):
+        """Rebuilds the live rows (and prototypes) outside the lock, then swaps them in.
+
+        Returns False without swapping if the gallery changed during the build.
+        """
+        with self._lock:
+            version = self.version
+            vectors, labels = self.live_embeddings()
+        fresh = self._build(vectors, labels)
+        with self._lock:
+            if self.version != version:
+                return False
+            self._swap_in(fresh)
+            return True
+
+    def _rebuild(self, attempts=3):
+        try:
+            for _ in range(attempts):
+                if not self._needs_compaction() or self._compact():
+                    break
+            with self._lock:
+                size, vectors, compactions = self._size, self._vectors[:self._size], self._compactions
+            if self.spec == 'exact' or not size:
+                return
+            ann = make_index(self.spec, metric='euclidean').fit(vectors)
+            with self._lock:
+                if self._compactions == compactions:
+                    self._ann, self._ann_rows = ann, size
+        except Exception as e:
+            print(f"⚠️ Face index rebuild failed: {e}")
+        finally:
+            with self._lock:
+                self._rebuilding = False
+
+    def kneighbors(self, queries, n_neighbors=None):
+        """(distances, row indices) of the nearest live embeddings, nearest first."""
+        distances, indices, _ = self._search(queries, n_neighbors)
+        return distances, indices
+
+    def _search(self, queries, n_neighbors=None):
+        """kneighbors plus the row -> label list the indices refer to (compaction swaps it)."""
+        queries = l2_normalise(queries)
+        with self._lock:
+            size, ann, ann_rows, labels = self._size, self._ann, self._ann_rows, self.labels
+            vectors, scales, alive = self._vectors[:size], self._scales[:size], self._alive[:size].copy()
+            k = min(n_neighbors or self.n_neighbors, len(self))
+        if not k:
+            raise ValueError('The face index is empty')
+
+        start = 0
+        candidates = []
+        if ann is not None:
+            # Ask for enough extra neighbours to cover tombstoned rows inside the ANN part
+            found = min(ann_rows, k + int(ann_rows - alive[:ann_rows].sum()))
+            distances, indices = ann.kneighbors(queries, found)
+            candidates.append((np.where(alive[indices], distances, np.inf), indices))
+            start = ann_rows
+        if start < size:
+            similarities = self._similarities(queries, vectors[start:], scales[start:])
+            distances = np.where(alive[None, start:], np.sqrt(np.maximum(2.0 - 2.0 * similarities, 0.0)), np.inf)
+            candidates.append((distances, np.broadcast_to(np.arange(start, size), distances.shape)))
+
+        distances = np.hstack([d for d, _ in candidates])
+        indices = np.hstack([i for _, i in candidates])
+        distances, order = smallest_k(distances, k)
+        return distances, np.take_along_axis(indices, order, axis=1), labels
+
+    def _similarities(self, queries, vectors, scales):
+        """queries @ vectors.T, upcasting quantised rows to float32 one block at a time."""
+        if vectors.dtype == np.float32:
+            return queries @ vectors.T
+        similarities = np.empty((len(queries), len(vectors)), dtype=np.float32)
+        for start in range(0, len(vectors), self.scan_block):
+            block = slice(start, start + self.scan_block)
+            similarities[:, block] = (queries @ vectors[block].astype(np.float32).T) * scales[block]
+        return similarities
+
+    def predict(self, queries):
+        """Majority label among the n_neighbors nearest embeddings; ties go to the smallest label."""
+        _, indices, labels = self._search(queries)
+        predictions = []
+        for row in indices:
+            names, counts = np.unique([labels[i] for i in row], return_counts=True)
+            predictions.append(names[np.argmax(counts)])
+        return np.array(predictions)
+
+    def recognise(self, embedding, top_k=5):
+        """Everything a scan needs from one search over the gallery.
+
+        Returns label (majority vote of the n_neighbors nearest embeddings, as
+        predict gives), distance (from the query to that label's nearest
+        embedding, the figure the acceptance threshold applies to), margin (how
+        much farther the closest other identity is than that, None with only
+        one identity; negative when the vote overrode a nearer identity) and
+        candidates, the top_k identities by their nearest embedding.
+        """
+        return self.recognise_many([embedding], top_k)[0]
+
+    def recognise_many(self, embeddings, top_k=5):
+        """recognise() for several faces at once, searched with a single matrix product."""
+        if self._prototypes is not None and len(self._prototypes):
+            shortlist = max(top_k, self.shortlist)
+            return [self._summarise(*self._search_shortlist(embedding, shortlist), top_k) for embedding in embeddings]
+
+        shortlist = max(top_k, self.shortlist) if self.rerank is not None else top_k
+        with self._lock:
+            depth = max(self.n_neighbors, shortlist * self._max_rows)
+        distances, indices, labels = self._search(embeddings, depth)
+        if self.rerank is None:
+            return [self._summarise(row_distances, row_indices, labels, top_k)
+                    for row_distances, row_indices in zip(distances, indices)]
+
+        results = []
+        for embedding, row_distances, row_indices in zip(embeddings, distances, indices):
+            identities = list(dict.fromkeys(labels[row] for row in row_indices[np.isfinite(row_distances)]))
+            reranked = self._rerank(embedding, identities[:shortlist])
+            results.append(self._summarise(*reranked, top_k) if reranked
+                           else self._summarise(row_distances, row_indices, labels, top_k))
+        return results
+
+    def _rerank(self, embedding, identities):
+        """Exact (distances, order, owners) over the rerank source's embeddings of identities, or None."""
+        vectors, owners = [], []
+        for label in identities:
+            rows = np.atleast_2d(np.asarray(self.rerank(label), dtype=np.float32))
+            if rows.size:
+                vectors.append(rows)
+                owners.extend([label] * len(rows))
+        if not owners:
+            return None
+        distances = np.sqrt(np.maximum(2.0 - 2.0 * (l2_normalise(np.vstack(vectors)) @ l2_normalise(embedding)[0]),
+                                       0.0))
+        order = np.argsort(distances, kind='stable')
+        return distances[order], order, owners
+
+    def _summarise(self, distances, indices, labels, top_k):
+        best = {}
+        for distance, row in zip(distances, indices):
+            if np.isfinite(distance):
+                best.setdefault(labels[row], float(distance))
+        voters = indices[np.isfinite(distances)][:self.n_neighbors]
+        names, counts = np.unique([labels[row] for row in voters], return_counts=True)
+        label = names[np.argmax(counts)]
+        # Distance and margin describe the voted identity, so the threshold is applied to the label returned
+        distance = best[label]
+        others = [other for name, other in best.items() if name != label]
+        candidates = [{'label': name, 'distance': other} for name, other in best.items()][:top_k]
+        return {
+            'label': str(label),
+            'distance': distance,
+            'margin': others[0] - distance if others else None,
+            'candidates': candidates,
+        }
+
+    def _search_shortlist(self, embedding, shortlist):
+        """Exact distances to every raw embedding of the identities whose prototypes are closest."""
+        query = l2_normalise(embedding)[0]
+        identities = [c['label'] for c in self._prototypes.recognise(embedding, top_k=shortlist)['candidates']]
+        if self.rerank is not None:
+            reranked = self._rerank(embedding, identities)
+            if reranked:
+                return reranked
+        with self._lock:
+            rows = np.array([row for label in identities for row in self._rows_by_label.get(label, [])], dtype=int)
+            vectors, labels = self._float_rows(rows), self.labels
+        distances = np.sqrt(np.maximum(2.0 - 2.0 * (vectors @ query), 0.0))
+        order = np.argsort(distances, kind='stable')
+        return distances[order], rows[order], labels
+
+    def subset(self, labels):
+        """A new exact index holding only the given identities' embeddings."""
+        with self._lock:
+            rows = [row for label in labels for row in self._rows_by_label.get(label, [])]
+            vectors, owners = self._float_rows(rows), [self.labels[row] for row in rows]
+        index = FaceIndex(n_neighbors=self.n_neighbors)
+        index.add_rows(vectors, owners)
+        return index
+
+    def live_embeddings(self):
+        with self._lock:
+            live = np.flatnonzero(self._alive[:self._size])
+            return self._float_rows(live), [self.labels[row] for row in live]
+
+    def save(self, path):
+        """Writes the live gallery to path atomically (temp file + rename)."""
+        with self._lock:
+            vectors, labels = self.live_embeddings()
+            state = {'n_neighbors': self.n_neighbors, 'spec': self.spec, 'precision': self.precision,
+                     'store_version': self.store_version, 'vectors': vectors, 'labels': labels}
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    def save_async(self, path, delay=1.0):
+        """Snapshots to path in the background; updates within delay seconds share one write."""
+        with self._lock:
+            self._save_path = path
+            if self._save_pending:
+                return
+            self._save_pending = True
+        timer = threading.Timer(delay, self._save_pending_snapshot)
+        timer.daemon = True
+        timer.start()
+
+    def _save_pending_snapshot(self):
+        with self._lock:
+            self._save_pending = False
+            path = self._save_path
+        try:
+            self.save(path)
+            print(f"✅ Face index snapshot saved ({len(self)} embeddings).")
+        except Exception as e:
+            print(f"⚠️ Face index snapshot failed: {e}")
+
+    @classmethod
+    def load(cls, path, spec=None, prototypes=None, rerank=None):
+        """The snapshot at path, at the precision it was saved with."""
+        with open(path, 'rb') as f:
+            state = pickle.load(f)
+        index = cls(n_neighbors=state['n_neighbors'], spec=spec or state['spec'], prototypes=prototypes,
+                    precision=state['precision'], rerank=rerank)
+        index.store_version = state['store_version']
+        index.add_rows(state['vectors'], state['labels'])
+        return index
+
+    @classmethod
+    def from_store(cls, store, n_neighbors=5, spec='exact', prototypes=None, precision='float32', rerank=None):
+        index = cls(n_neighbors=n_neighbors, spec=spec, prototypes=prototypes, precision=precision, rerank=rerank)
+        index.store_version, vectors, labels = store.snapshot()
+        index.add_rows(vectors, labels)
+        return index
+
+
+def open_face_index(store, path, n_neighbors=5, spec='exact', prototypes=None, precision='float32', rerank=False):
+    """The snapshot at path if it matches the store's current contents and precision, else a fresh build from the store.
+
+    A snapshot saved at another precision is rebuilt, as its quantised rows
+    cannot be restored to float32. With rerank, scans re-rank their shortlist
+    with the store's float32 embeddings.
+    """
+    rerank = store.embeddings_of if rerank else None
+    try:
+        index = FaceIndex.load(path, spec=spec, prototypes=prototypes, rerank=rerank)
+        if index.store_version == store.version and index.precision == precision:
+            print(f"✅ Face index loaded from {path} ({len(index)} embeddings).")
+            return index
+    except (FileNotFoundError, KeyError, TypeError, ValueError, pickle.UnpicklingError, EOFError, AttributeError):
+        pass
+    index = FaceIndex.from_store(store, n_neighbors=n_neighbors, spec=spec, prototypes=prototypes,
+                                 precision=precision, rerank=rerank)
+    if len(index):
+        index.save_async(path)
+    print(f"✅ Face index built from the face store ({len(index)} embeddings).")
+    return index
+
+
+def follow_store(index, store, interval=1.0):
+    """Keeps index in step with store writes from other processes by checking the store's version every interval seconds."""
+    def watch():
+        while True:
+            time.sleep(interval)
+            try:
+                if index.sync(store):
+                    print(f"✅ Face index caught up with the face store ({len(index)} embeddings).")
+            except Exception as e:
+                print(f"⚠️ Face index sync failed: {e}")
+
+    thread = threading.Thread(target=watch, name='face-index-sync', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,79 @@
+import os
+import threading
+import time
+
+import numpy as np
+from deepface import DeepFace
+
+MODEL_NAME = 'VGG-Face'
+DETECTOR_BACKEND = 'opencv'
+
+# Set FACE_PRELOAD=0 to skip the startup warm-up (models then load on the first request)
+FACE_PRELOAD = os.environ.get('FACE_PRELOAD', '1') != '0'
+
+model_status = {'ready': False, 'loading': False, 'error': None, 'seconds': None}
+_ready = threading.Event()
+_lock = threading.Lock()
+
+
+def get_embedding_model():
+    """The process-wide VGG-Face instance; DeepFace caches it after the first build."""
+    return DeepFace.build_model(MODEL_NAME)
+
+
+def get_detector():
+    return DeepFace.build_model(DETECTOR_BACKEND, task='face_detector')
+
+
+def preload_models():
+    """Loads the detector and VGG-Face weights and runs one inference on a dummy image.
+
+    The first forward pass also builds the TensorFlow graph, so afterwards
+    a real scan pays only the inference cost.
+    """
+    started = time.perf_counter()
+    try:
+        get_detector()
+        get_embedding_model()
+        dummy = np.zeros((224, 224, 3), dtype=np.uint8)
+        DeepFace.extract_faces(dummy, detector_backend=DETECTOR_BACKEND, enforce_detection=False)
+        DeepFace.represent(dummy, model_name=MODEL_NAME, detector_backend=DETECTOR_BACKEND, enforce_detection=False)
+    except Exception as e:
+        model_status.update(loading=False, error=str(e))
+        print(f"⚠️ Face model warm-up failed: {e}")
+        return False
+
+    model_status.update(ready=True, loading=False, error=None, seconds=round(time.perf_counter() - started, 3))
+    _ready.set()
+    print(f"✅ Face models warmed up in {model_status['seconds']}s.")
+    return True
+
+
+def start_preload():
+    """Warms the models in a background thread so the server can answer /health meanwhile."""
+    if not FACE_PRELOAD:
+        return
+    with _lock:
+        if model_status['ready'] or model_status['loading']:
+            return
+        model_status['loading'] = True
+    threading.Thread(target=preload_models, name='face-model-preload', daemon=True).start()
+
+
+def set_status(status):
+    """Adopts a warm-up result reported by the face worker processes."""
+    model_status.update(status)
+    if model_status['ready']:
+        _ready.set()
+
+
+def wait_until_ready(timeout=None):
+    return _ready.wait(timeout)
+
+
+def health():
+    """(payload, HTTP status) for the /health route: 200 once warm, 503 while loading or failed."""
+    ready = model_status['ready'] or not FACE_PRELOAD
+    payload = {'success': ready, 'models': dict(model_status, model=MODEL_NAME, detector=DETECTOR_BACKEND,
+                                                preload=FACE_PRELOAD)}
+    return payload, 200 if ready else 503
@@ -0,0 +1,294 @@
+import io
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+from deepface import DeepFace
+from deepface.modules import preprocessing
+from PIL import Image
+
+from face_models import DETECTOR_BACKEND, get_embedding_model
+
+# Decoding releases the GIL inside OpenCV, so a few threads decode an upload batch in parallel
+DECODE_THREADS = int(os.environ.get('FACE_DECODE_THREADS', 4))
+decode_pool = ThreadPoolExecutor(max_workers=DECODE_THREADS)
+EMBED_BATCH_SIZE = int(os.environ.get('FACE_EMBED_BATCH_SIZE', 32))
+
+# Uploads are refused before decoding past either limit
+FACE_MAX_UPLOAD_BYTES = int(float(os.environ.get('FACE_MAX_UPLOAD_MB', 15)) * 1024 * 1024)
+FACE_MAX_PIXELS = int(os.environ.get('FACE_MAX_PIXELS', 50_000_000))
+# Whole request bodies are refused by Flask past this: a capture's images (the app sends 10) plus form fields
+FACE_MAX_UPLOAD_FILES = int(os.environ.get('FACE_MAX_UPLOAD_FILES', 10))
+FACE_MAX_REQUEST_BYTES = FACE_MAX_UPLOAD_FILES * FACE_MAX_UPLOAD_BYTES + 1024 * 1024
+# Larger images are decoded at 1/2, 1/4 or 1/8 scale, keeping the longest side at least this long
+FACE_DECODE_MAX_SIDE = int(os.environ.get('FACE_DECODE_MAX_SIDE', 1600))
+REDUCED_DECODE_FLAGS = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4),
+                        (2, cv2.IMREAD_REDUCED_COLOR_2))
+
+HAAR_CASCADE_PATH = cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'
+# Longest image side the Haar pre-check runs at, so 12MP phone uploads are checked at 640px; 0 for full resolution
+HAAR_MAX_SIDE = int(os.environ.get('HAAR_MAX_SIDE', 640))
+# Set FACE_HAAR_GATE=0 to send enrollment images to DeepFace detection without the Haar pre-check
+FACE_HAAR_GATE = os.environ.get('FACE_HAAR_GATE', '1') != '0'
+_thread_cascades = threading.local()
+
+# Largest Euclidean distance between unit-length embeddings accepted as the same person
+FACE_MATCH_THRESHOLD = 0.57
+GROUP_MAX_FACES = int(os.environ.get('GROUP_MAX_FACES', 50))
+
+
+def get_face_cascade(path=HAAR_CASCADE_PATH):
+    """The Haar cascade for path, loaded once per thread: a CascadeClassifier must not be shared across threads."""
+    cascades = getattr(_thread_cascades, 'by_path', None)
+    if cascades is None:
+        cascades = _thread_cascades.by_path = {}
+    cascade = cascades.get(path)
+    if cascade is None:
+        cascade = cv2.CascadeClassifier(path)
+        if cascade.empty():
+            raise IOError(f"Could not load Haar cascade from {path}")
+        cascades[path] = cascade
+    return cascade
+
+def detect_face_using_opencv(image, max_side=None):
+    """Haar face boxes (x, y, w, h) in the coordinates of image.
+
+    With max_side (default HAAR_MAX_SIDE) set, detection runs on a copy whose
+    longest side is at most max_side pixels and the boxes are scaled back.
+    """
+    max_side = HAAR_MAX_SIDE if max_side is None else max_side
+
+    # Convert the image to grayscale for better face detection
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    scale = 1.0
+    if max_side and max(gray.shape) > max_side:
+        scale = max_side / max(gray.shape)
+        gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+    # Detect faces
+    faces = get_face_cascade().detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(30, 30))
+    if scale != 1.0 and len(faces):
+        faces = np.round(np.asarray(faces) / scale).astype(int)
+
+    return faces
+
+def is_valid_face(face_image):
+    if face_image.shape[0] < 50 or face_image.shape[1] < 50:
+        return False
+    return True
+
+
+class ImageRejected(ValueError):
+    """An upload refused before decoding because it has too many bytes or pixels."""
+
+
+def read_upload(file):
+    """An uploaded file's bytes, refused once past FACE_MAX_UPLOAD_BYTES without reading the rest."""
+    data = file.read(FACE_MAX_UPLOAD_BYTES + 1)
+    if len(data) > FACE_MAX_UPLOAD_BYTES:
+        raise ImageRejected(f"Image larger than {FACE_MAX_UPLOAD_BYTES / (1024 * 1024):g}MB")
+    return data
+
+
+def image_dimensions(data):
+    """(width, height) from the image header alone, or None if Pillow cannot read it.
+
+    Raises ImageRejected for headers Pillow itself treats as a decompression bomb.
+    """
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            return img.size
+    except Image.DecompressionBombError as e:
+        raise ImageRejected(str(e))
+    except Exception:
+        return None
+
+
+def decode_scaled(data, max_side=None):
+    """(BGR image, scale) where scale maps its coordinates back to the original image.
+
+    Nothing is decoded unless the header gives dimensions within
+    FACE_MAX_PIXELS: an unreadable header comes back as a None image, like
+    data that does not decode, and an oversized one raises ImageRejected.
+    Images whose longest side is at least twice max_side (default
+    FACE_DECODE_MAX_SIDE) are decoded at a reduced scale, which libjpeg does
+    without building the full-size frame.
+    """
+    max_side = max_side or FACE_DECODE_MAX_SIDE
+    size = image_dimensions(data)
+    if size is None:
+        return None, 1
+    if size[0] * size[1] > FACE_MAX_PIXELS:
+        raise ImageRejected(f"Image of {size[0]}x{size[1]} pixels is over the {FACE_MAX_PIXELS} pixel limit")
+    flag, scale = cv2.IMREAD_COLOR, 1
+    for factor, reduced in REDUCED_DECODE_FLAGS:
+        if max(size) >= factor * max_side:
+            flag, scale = reduced, factor
+            break
+
+    image = cv2.imdecode(np.frombuffer(data, np.uint8), flag)
+    if image is None:
+        return None, 1
+    if scale != 1:
+        # Reduced decodes round up, so take the exact ratio per image
+        scale = max(size) / max(image.shape[:2])
+    return image, scale
+
+
+def decode_image(data):
+    return decode_scaled(data)[0]
+
+
+def decode_uploads(payloads):
+    """Decodes the uploaded files' bytes in parallel."""
+    return list(decode_pool.map(decode_image, payloads))
+
+
+def detect_faces(image, gate=False):
+    """The single detection pass: every face DeepFace finds in image as (crop, box), largest first.
+
+    Crops are extract_faces' RGB floats and go to embed_faces as they are,
+    without being detected again. With gate, a Haar check on a frame
+    downscaled to HAAR_MAX_SIDE first skips images with no face at all.
+    With enforce_detection=False DeepFace returns the whole frame when it
+    finds no face; that comes back here as an empty list.
+    """
+    if gate and len(detect_face_using_opencv(image)) == 0:
+        return []
+    height, width = image.shape[:2]
+    found = []
+    for face in DeepFace.extract_faces(image, detector_backend=DETECTOR_BACKEND, enforce_detection=False):
+        area = face['facial_area']
+        if face['confidence'] == 0 and area['w'] >= width - 1 and area['h'] >= height - 1:
+            continue
+        found.append((face['face'], {key: int(area[key]) for key in ('x', 'y', 'w', 'h')}))
+    found.sort(key=lambda item: item[1]['w'] * item[1]['h'], reverse=True)
+    return found
+
+
+def detect_enrollment_faces(images):
+    """The face crops usable for enrollment: exactly one face of at least 50px per image."""
+    crops = []
+    for img in images:
+        faces = detect_faces(img, gate=FACE_HAAR_GATE)
+        if len(faces) != 1:
+            if len(faces) > 1:
+                print("Multiple faces detected in an image. Skipping this image...")
+            continue
+        if is_valid_face(faces[0][0]):
+            crops.append(faces[0][0])
+    return crops
+
+
+def prepare_face(face_image):
+    """The model input for one detected crop.
+
+    Crops keep extract_faces' RGB order, the channel order the registered
+    embeddings were computed with.
+    """
+    height, width = get_embedding_model().input_shape
+    return preprocessing.resize_image(face_image, target_size=(width, height))[0]
+
+
+def embed_faces(face_images, batch_size=None):
+    """L2-normalised embeddings of detected crops, with one forward pass per batch."""
+    batch_size = batch_size or EMBED_BATCH_SIZE
+    model = get_embedding_model()
+    embeddings = []
+    for start in range(0, len(face_images), batch_size):
+        batch = np.stack([prepare_face(face_image) for face_image in face_images[start:start + batch_size]])
+        outputs = np.asarray(model.model(batch, training=False).numpy(), dtype=np.float64)
+        norms = np.linalg.norm(outputs, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        embeddings.extend(row.tolist() for row in outputs / norms)
+    return embeddings
+
+
+def enrollment_embeddings(payloads):
+    """Decode -> detect -> batched embed for one enrollment upload's file bytes, logging each stage's time.
+
+    Returns the embeddings of the valid faces, or None if an upload is not a
+    decodable image. Detection and model errors propagate to the caller.
+    Takes bytes rather than uploaded files so it can run in a face worker.
+    """
+    started = time.perf_counter()
+    images = decode_uploads(payloads)
+    decoded = time.perf_counter()
+    if any(img is None for img in images):
+        return None
+
+    crops = detect_enrollment_faces(images)
+    detected = time.perf_counter()
+    embeddings = embed_faces(crops)
+    embedded = time.perf_counter()
+
+    print(f"⏱️ Enrollment of {len(images)} images: decode {decoded - started:.3f}s, "
+          f"detect {detected - decoded:.3f}s, embed {embedded - detected:.3f}s "
+          f"({len(embeddings)} valid faces)")
+    return embeddings
+
+
+def scan_embedding(data):
+    """Decode -> detect -> embed for one attendance snap: (embedding, number of faces found).
+
+    The embedding is None unless exactly one face was found; both are None
+    when data is not a decodable image.
+    """
+    image = decode_image(data)
+    if image is None:
+        return None, None
+    faces = detect_faces(image)
+    if len(faces) != 1:
+        return None, len(faces)
+    return embed_faces([faces[0][0]])[0], 1
+
+
+def group_embeddings(data):
+    """Decode -> detect -> batched embed for a group photo: (boxes, embeddings), or None if undecodable.
+
+    At most GROUP_MAX_FACES faces, largest first; embeddings are None for faces too small to use.
+    """
+    image, scale = decode_scaled(data)
+    if image is None:
+        return None
+    started = time.perf_counter()
+    faces = detect_faces(image)[:GROUP_MAX_FACES]
+    detected = time.perf_counter()
+
+    embeddings = [None] * len(faces)
+    valid = [i for i, (crop, _) in enumerate(faces) if is_valid_face(crop)]
+    for i, embedding in zip(valid, embed_faces([faces[i][0] for i in valid])):
+        embeddings[i] = embedding
+
+    print(f"⏱️ Group photo with {len(faces)} faces: detect {detected - started:.3f}s, "
+          f"embed {time.perf_counter() - detected:.3f}s")
+    boxes = [{key: int(round(value * scale)) for key, value in box.items()} for _, box in faces]
+    return boxes, embeddings
+
+
+def recognise_group(gallery, boxes, embeddings, threshold=FACE_MATCH_THRESHOLD):
+    """Per-face results for a group photo, matched with one gallery search.
+
+    A volunteer matched by several faces keeps only the closest of them.
+    """
+    results = [{'box': box, 'matched': False, 'label': None, 'distance': None, 'margin': None} for box in boxes]
+    embedded = [i for i, embedding in enumerate(embeddings) if embedding is not None]
+
+    best = {}
+    if embedded:
+        for i, match in zip(embedded, gallery.recognise_many([embeddings[i] for i in embedded])):
+            result = results[i]
+            result.update(distance=match['distance'], margin=match['margin'])
+            if match['distance'] >= threshold:
+                continue
+            other = best.get(match['label'])
+            if other is not None and other['distance'] <= match['distance']:
+                continue
+            if other is not None:
+                other.update(matched=False, label=None)
+            result.update(matched=True, label=match['label'])
+            best[match['label']] = result
+    return results
@@ -0,0 +1,344 @@
+import os
+import threading
+from concurrent.futures import TimeoutError as FaceJobTimeout
+from flask import Blueprint, request, jsonify
+from face_models import health
+from face_pipeline import (FACE_MATCH_THRESHOLD, FACE_MAX_REQUEST_BYTES, ImageRejected, read_upload,
+                           enrollment_embeddings, scan_embedding, group_embeddings, recognise_group)
+from face_workers import ATTENDANCE, ENROLLMENT, FaceWorkerPool, PoolBusy
+from face_store import FaceEmbeddingStore
+from enrollment_buffer import EnrollmentBuffer
+from face_index import open_face_index, follow_store
+from event_gallery import EventGalleries
+
+
+# Face registration and attendance routes, served by both rec.py and face_scan_server.py.
+# Each app sets MAX_CONTENT_LENGTH to FACE_MAX_REQUEST_BYTES and calls start_services().
+blueprint = Blueprint('face', __name__)
+
+# Ensure 'data' directory exists
+os.makedirs('data', exist_ok=True)
+
+# Captures waiting for /register or /confirmEditFace, shared by every thread and worker process on the box
+enrollment_buffer = EnrollmentBuffer('data/enrollment_buffer.db',
+                                     ttl_seconds=int(os.environ.get('ENROLLMENT_TTL', 1800)),
+                                     max_bytes=int(os.environ.get('ENROLLMENT_BUFFER_MB', 64)) * 1024 * 1024)
+
+# Registered face embeddings (replaces data/faces_data.pkl and data/names_data.pkl, imported on first run)
+face_store = FaceEmbeddingStore('data/face_store')
+face_store.import_pickles()
+
+# In-memory face gallery, updated per registration and snapshotted here in the background
+FACE_INDEX_PATH = 'data/face_index.pkl'
+
+# k-NN backend for face matching: 'exact', 'ivf:n_lists=..,n_probe=..' or 'hnsw:ef=..' (see ann_index.py)
+FACE_ANN_INDEX = os.environ.get('FACE_ANN_INDEX', 'exact')
+# Optional prototype search for attendance: '' (off), 'centroid' or 'medoid:<m>' (see face_index.py)
+FACE_PROTOTYPES = os.environ.get('FACE_PROTOTYPES', '')
+# Gallery precision in memory: 'float32' or 'int8' (exact backend only, see face_index.quantise);
+# quantised scans re-rank their shortlist with the face store's float32 embeddings unless FACE_RERANK=0
+FACE_PRECISION = os.environ.get('FACE_PRECISION', 'float32')
+FACE_RERANK = os.environ.get('FACE_RERANK', '1') != '0'
+
+@blueprint.route('/start_capture', methods=['POST'])
+def start_capture():
+    try:
+        if 'image0' not in request.files:
+            return jsonify({'success': False, 'message': 'No images uploaded'}), 400
+
+        name = request.form.get('email')  
+        files = [file for key, file in request.files.items()]
+
+        if name in face_store:
+            return jsonify({'success': False, 'message': f"The email - '{name}' already exists. Please use a different email."}), 400
+
+        payloads, error = read_uploads(files)
+        if error:
+            return error
+        try:
+            embeddings, error = face_job(ENROLLMENT, enrollment_embeddings, payloads)
+        except Exception as e:
+            return jsonify({'success': False, 'message': f'Error during face detection: {str(e)}'}), 500
+        if error:
+            return error
+        if embeddings is None:
+            return jsonify({'success': False, 'message': 'Invalid image file'}), 400
+
+        valid_faces_count = len(embeddings)
+        print('valid face', valid_faces_count)
+
+        if valid_faces_count < 4:
+            return jsonify({'success': False, 'message': 'Insufficient valid faces detected. Please upload more images with clear faces.'}), 400
+
+        # Stage the capture until /register; the token identifies it to the client
+        token = enrollment_buffer.put(name, 'register', embeddings)
+        return jsonify({'success': True, 'message': 'Faces data captured successfully', 'token': token})
+
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@blueprint.route('/edit_face_data', methods=['POST'])
+def edit_face_data():
+    try:
+        if 'image0' not in request.files:
+            return jsonify({'success': False, 'message': 'No images uploaded'}), 400
+
+        name = request.form.get('email')  # Retrieve the name
+        files = [file for key, file in request.files.items()]
+
+        # Validate if name already exists
+        if name not in face_store:
+            return jsonify({'success': False, 'message': f"The email - '{name}' does not exist. Please contact admin."}), 400
+
+        # Decode, detect and embed all uploads, with one batched forward pass
+        payloads, error = read_uploads(files)
+        if error:
+            return error
+        try:
+            embeddings, error = face_job(ENROLLMENT, enrollment_embeddings, payloads)
+        except Exception as e:
+            return jsonify({'success': False, 'message': 'Error during face detection'}), 500
+        if error:
+            return error
+        if embeddings is None:
+            return jsonify({'success': False, 'message': 'Invalid image file'}), 400
+
+        valid_faces_count = len(embeddings)
+
+        # If less than 8 valid faces are detected, return an error
+        if valid_faces_count < 4:
+            return jsonify({'success': False, 'message': 'Please make sure to follow the guidelines for face data collecting!'}), 400
+
+        # Stage the new faces until /confirmEditFace
+        token = enrollment_buffer.put(name, 'edit', embeddings)
+        return jsonify({'success': True, 'message': 'Faces data captured successfully', 'token': token})
+
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@blueprint.route('/register', methods=['POST'])
+def register():
+    try:
+        # The capture from /start_capture: by its token, or the latest one for the email from older clients
+        data = request.get_json(silent=True) or request.form
+        capture = enrollment_buffer.take('register', token=data.get('captureToken'), email=data.get('email'))
+        if capture is None:
+            return jsonify({'success': False, 'message': 'No data captured please add the face follow by guild'}), 400
+        name, embeddings = capture
+        if name in face_store:
+            return jsonify({'success': False, 'message': f"The email - '{name}' already exists. Please use a different email."}), 400
+
+        # Save face data and names
+        names_data = [name] * len(embeddings)
+        save_face_data(embeddings, names_data)
+
+        # Make the new faces searchable right away, no retraining; other workers pick them up from the store
+        face_index.sync(face_store)
+        face_index_updated()
+
+        return jsonify({'success': True, 'message': 'Face registered successfully !'})
+
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+#edit face data
+@blueprint.route('/confirmEditFace', methods=['POST'])
+def confirm_edit_face():
+    try:
+        # email = request.form.get('email')  # Get the email from the request
+        email = request.json.get('email')
+        if not email:
+            return jsonify({'success': False, 'message': 'Email is required'}), 400
+
+        # Ensure email exists in the data, before taking (and so deleting) its capture
+        if email not in face_store:
+            return jsonify({'success': False, 'message': f"No data found for email: {email}"}), 400
+
+        capture = enrollment_buffer.take('edit', token=request.json.get('captureToken'), email=email)
+        if capture is None:
+            return jsonify({'success': True, 'message': 'No face data to update, success.'}), 200
+        if capture[0] != email:
+            return jsonify({'success': False, 'message': 'The captured face data belongs to a different email.'}), 400
+        embeddings = capture[1]
+
+        # Tombstone the old embeddings for the email and append the captured ones
+        face_store.replace(email, embeddings)
+
+        face_index.sync(face_store)
+        face_index_updated()
+
+        return jsonify({'success': True, 'message': 'Face data updated successfully !'})
+
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+def face_job(priority, func, *args):
+    """func(*args) in the face worker pool: (result, None), or (None, error response) when busy or timed out."""
+    try:
+        return face_pool.run(priority, func, *args), None
+    except PoolBusy as e:
+        response = jsonify({'success': False, 'message': 'Face recognition is busy, please try again shortly.'})
+        response.headers['Retry-After'] = str(e.retry_after)
+        return None, (response, 429)
+    except FaceJobTimeout:
+        return None, (jsonify({'success': False, 'message': 'Face recognition timed out, please try again.'}), 504)
+    except ImageRejected as e:
+        return None, (jsonify({'success': False, 'message': str(e)}), 413)
+
+@blueprint.before_app_request
+def parse_uploads():
+    # Parse multipart bodies up front, so one over MAX_CONTENT_LENGTH gets the 413 below rather than a route's 500
+    request.files
+
+@blueprint.app_errorhandler(413)
+def request_too_large(e):
+    return jsonify({'success': False, 'message': f"Upload larger than {FACE_MAX_REQUEST_BYTES // (1024 * 1024)}MB"}), 413
+
+def read_uploads(files):
+    """The uploads' bytes, each capped before it is read in full: (payloads, None), or (None, 413 response)."""
+    try:
+        return [read_upload(file) for file in files], None
+    except ImageRejected as e:
+        return None, (jsonify({'success': False, 'message': str(e)}), 413)
+
+def attendance_gallery():
+    """The gallery a scan searches: with an eventId only that event's participants, else every registered face."""
+    event_id = request.form.get('eventId')
+    if not event_id:
+        return face_index
+    roster = [email.strip() for value in request.form.getlist('roster')
+              for email in value.split(',') if email.strip()] or None
+    return event_galleries.get(event_id, roster)
+
+@blueprint.route('/mark_attendance', methods=['POST'])
+def mark_attendance():
+    if not len(face_index):
+        return jsonify({'success': False, 'message': 'Error during mark attendance please contact the organization !'}), 500
+
+    try:
+        try:
+            gallery = attendance_gallery()
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+        if not len(gallery):
+            return jsonify({'success': False, 'message': 'No registered faces for the participants of this event.'}), 400
+
+        payloads, error = read_uploads([request.files['image']])
+        if error:
+            return error
+        scan, error = face_job(ATTENDANCE, scan_embedding, payloads[0])
+        if error:
+            return error
+        face_embedding, face_count = scan
+        if face_count is None:
+            return jsonify({'success': False, 'message': 'Invalid image file'}), 400
+        if face_embedding is None:
+            return jsonify({'success': False, 'message': 'Please provide snap with exactly one face.'}), 400
+
+        # One search gives the voted label, nearest distance and margin to the runner-up
+        match = gallery.recognise(face_embedding)
+        min_distance = match['distance']
+        print(min_distance, match['margin'])
+        threshold = FACE_MATCH_THRESHOLD
+        if min_distance < threshold:
+            predicted_name = match['label']
+            return jsonify({'success': True, 'message': f"Attendance marked successfully for {predicted_name}!",
+                            'distance': min_distance, 'margin': match['margin']})
+        else:
+            return jsonify({'success': False, 'message': 'Face not recognized. Distance too large.'}), 400
+
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@blueprint.route('/group_check_in', methods=['POST'])
+def group_check_in():
+    """Checks in every recognised face of one group photo; returns per-face results with bounding boxes."""
+    if not len(face_index):
+        return jsonify({'success': False, 'message': 'Error during mark attendance please contact the organization !'}), 500
+
+    try:
+        try:
+            gallery = attendance_gallery()
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+        if not len(gallery):
+            return jsonify({'success': False, 'message': 'No registered faces for the participants of this event.'}), 400
+
+        payloads, error = read_uploads([request.files['image']])
+        if error:
+            return error
+        photo, error = face_job(ATTENDANCE, group_embeddings, payloads[0])
+        if error:
+            return error
+        if photo is None:
+            return jsonify({'success': False, 'message': 'Invalid image file'}), 400
+        boxes, embeddings = photo
+        if not boxes:
+            return jsonify({'success': False, 'message': 'No faces found in the photo.'}), 400
+
+        results = recognise_group(gallery, boxes, embeddings)
+        checked_in = [result['label'] for result in results if result['matched']]
+        return jsonify({'success': bool(checked_in),
+                        'message': f"Attendance marked for {len(checked_in)} of {len(boxes)} faces.",
+                        'checked_in': checked_in,
+                        'faces': results})
+
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+def save_face_data(faces_data, names_data):
+    # Appends only the new rows; earlier registrations are not rewritten
+    face_store.add(faces_data, names_data)
+
+    print("✅ Face data and names stored successfully.")
+
+def face_index_updated():
+    # Snapshot the index, stamped with the store version it reflects, off the request thread
+    face_index.save_async(FACE_INDEX_PATH)
+
+# Set by start_services(), once per server process
+face_pool = None
+face_index = None
+event_galleries = None
+_services_lock = threading.Lock()
+
+def start_services(resolve_participants=None, on_start=None):
+    """Starts the face workers, face index and store sync once per server process.
+
+    resolve_participants(event_id) lists an event's participant emails for
+    the event galleries; without it they come from the request's roster.
+    on_start() runs once, under the same lock, for the app's own services.
+    Each app calls this under __main__ and before the first request rather
+    than on import: the spawned face workers import the app script again
+    and must not start any of it.
+    """
+    global face_pool, face_index, event_galleries
+    if face_pool is not None:
+        return
+    with _services_lock:
+        if face_pool is not None:
+            return
+        # DeepFace runs in preloaded worker processes (FACE_WORKERS)
+        pool = FaceWorkerPool()
+
+        # Load the face index at startup: the last snapshot if it is current, else built from the face store
+        face_index = open_face_index(face_store, FACE_INDEX_PATH, n_neighbors=5, spec=FACE_ANN_INDEX,
+                                     prototypes=FACE_PROTOTYPES, precision=FACE_PRECISION,
+                                     rerank=FACE_RERANK and FACE_PRECISION != 'float32')
+        # Registrations and edits made by other server processes reach this one within FACE_SYNC_SECONDS
+        follow_store(face_index, face_store, interval=float(os.environ.get('FACE_SYNC_SECONDS', 1)))
+
+        event_galleries = EventGalleries(face_index, resolve_participants=resolve_participants,
+                                         ttl_seconds=float(os.environ.get('EVENT_GALLERY_TTL', 300)))
+        if on_start is not None:
+            on_start()
+
+        # Load the detector and VGG-Face once per worker process, before the first scan needs them
+        pool.start()
+        face_pool = pool
+
+@blueprint.route('/health', methods=['GET'])
+def health_route():
+    payload, status = health()
+    payload['workers'] = face_pool.stats()
+    return jsonify(payload), status
@@ -0,0 +1,300 @@
+import json
+import os
+import pickle
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process lock, run a single writer process
+    fcntl = None
+
+
+class FaceEmbeddingStore:
+    """Append-only store of face embeddings keyed by email.
+
+    Embeddings live in a raw float32 file that readers memory-map; a JSON-lines
+    log records each append (its first row and per-row labels) and each email
+    tombstone. Registering costs O(new faces) and opening the store replays the
+    log instead of unpickling every embedding. compact() rewrites the live rows
+    into a new generation, automatically once tombstoned rows pass compact_ratio.
+    """
+
+    def __init__(self, directory='data/face_store', compact_ratio=0.5, min_compact_rows=256):
+        self.directory = directory
+        self.compact_ratio = compact_ratio
+        self.min_compact_rows = min_compact_rows
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.RLock()
+        self._reset(self._read_generation())
+        self.refresh()
+
+    def _reset(self, generation):
+        self.generation = generation
+        self.dim = None
+        self.labels = []
+        self._alive = []
+        self._rows_by_label = {}
+        self._log_offset = 0
+        self._map = None
+
+    def _read_generation(self):
+        try:
+            with open(os.path.join(self.directory, 'CURRENT')) as f:
+                return int(f.read().strip())
+        except FileNotFoundError:
+            return 0
+
+    def _embeddings_path(self, generation=None):
+        return os.path.join(self.directory, f"embeddings-{self.generation if generation is None else generation}.f32")
+
+    def _log_path(self, generation=None):
+        return os.path.join(self.directory, f"log-{self.generation if generation is None else generation}.jsonl")
+
+    def refresh(self):
+        """Applies log records written since the last call, by this or another process."""
+        with self._lock:
+            generation = self._read_generation()
+            if generation != self.generation:
+                self._reset(generation)
+            try:
+                if os.path.getsize(self._log_path()) == self._log_offset:
+                    return False
+                with open(self._log_path(), 'rb') as f:
+                    f.seek(self._log_offset)
+                    data = f.read()
+            except FileNotFoundError:
+                return False
+
+            # A line still being written has no newline yet; pick it up next time
+            complete = data[:data.rfind(b'\n') + 1]
+            for line in complete.splitlines():
+                if line.strip():
+                    self._apply(json.loads(line))
+            self._log_offset += len(complete)
+            return bool(complete)
+
+    def _apply(self, record):
+        if record['op'] == 'add':
+            if record['start'] != len(self.labels):
+                raise ValueError(f"Face store log out of order at row {record['start']} in {self._log_path()}")
+            self.dim = record['dim']
+            for row, label in enumerate(record['labels'], start=record['start']):
+                self.labels.append(label)
+                self._alive.append(True)
+                self._rows_by_label.setdefault(label, []).append(row)
+            self._map = None
+        elif record['op'] == 'remove':
+            for row in self._rows_by_label.pop(record['label'], []):
+                self._alive[row] = False
+
+    @contextmanager
+    def _writing(self):
+        """Serialises writers across threads and, where flock exists, across processes."""
+        with self._lock:
+            with open(os.path.join(self.directory, 'lock'), 'a') as lock_file:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    self.refresh()
+                    yield
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _append_log(self, records):
+        with open(self._log_path(), 'a') as f:
+            f.write(''.join(json.dumps(record) + '\n' for record in records))
+            f.flush()
+            os.fsync(f.fileno())
+        self.refresh()
+
+    def _append_rows(self, embeddings, labels):
+        """Writes the rows and returns their log record; the caller appends it to the log."""
+        embeddings = np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+        if len(labels) != embeddings.shape[0]:
+            raise ValueError(f"{embeddings.shape[0]} embeddings but {len(labels)} labels")
+        if self.dim is not None and embeddings.shape[1] != self.dim:
+            raise ValueError(f"Embedding size {embeddings.shape[1]} does not match the store's {self.dim}")
+
+        start = len(self.labels)
+        path = self._embeddings_path()
+        # Rows past the log's end were written by a writer that died before logging them
+        if os.path.exists(path) and os.path.getsize(path) != start * embeddings.shape[1] * 4:
+            os.truncate(path, start * embeddings.shape[1] * 4)
+        with open(path, 'ab') as f:
+            f.write(np.ascontiguousarray(embeddings).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        return {'op': 'add', 'start': start, 'dim': int(embeddings.shape[1]), 'labels': list(labels)}
+
+    def add(self, embeddings, labels):
+        """Appends embeddings with one label per row."""
+        if not len(labels):
+            return 0
+        with self._writing():
+            self._append_log([self._append_rows(embeddings, labels)])
+        return len(labels)
+
+    def remove(self, label):
+        """Tombstones every row of label; returns how many were removed."""
+        with self._writing():
+            removed = len(self._rows_by_label.get(label, []))
+            if removed:
+                self._append_log([{'op': 'remove', 'label': label}])
+                self._maybe_compact()
+        return removed
+
+    def replace(self, label, embeddings):
+        """Swaps label's rows for new ones; readers see either the old or the new set."""
+        with self._writing():
+            records = [{'op': 'remove', 'label': label}]
+            if len(embeddings):
+                records.append(self._append_rows(embeddings, [label] * len(embeddings)))
+            self._append_log(records)
+            self._maybe_compact()
+
+    def __contains__(self, label):
+        self.refresh()
+        return label in self._rows_by_label
+
+    def __len__(self):
+        """Number of live embeddings."""
+        self.refresh()
+        return sum(len(rows) for rows in self._rows_by_label.values())
+
+    @property
+    def version(self):
+        """Changes with every write; equal versions mean equal contents."""
+        self.refresh()
+        return (self.generation, self._log_offset)
+
+    def changes_since(self, version):
+        """(version, records) for the log records written after version; each add carries its 'embeddings'.
+
+        records is None when the store has been compacted since version: the
+        older records are gone and a reader reloads a snapshot() instead.
+        """
+        with self._lock:
+            self.refresh()
+            current = (self.generation, self._log_offset)
+            if version is None or version[0] != self.generation:
+                return current, None
+            if version[1] == self._log_offset:
+                return current, []
+            try:
+                with open(self._log_path(), 'rb') as f:
+                    f.seek(version[1])
+                    data = f.read(self._log_offset - version[1])
+            except FileNotFoundError:  # compacted by another process since refresh()
+                return self.version, None
+            records = [json.loads(line) for line in data.splitlines() if line.strip()]
+            for record in records:
+                if record['op'] == 'add':
+                    rows = slice(record['start'], record['start'] + len(record['labels']))
+                    record['embeddings'] = np.asarray(self._matrix()[rows])
+            return current, records
+
+    def names(self):
+        self.refresh()
+        return list(self._rows_by_label)
+
+    def _matrix(self):
+        if self._map is None and self.labels:
+            self._map = np.memmap(self._embeddings_path(), dtype=np.float32, mode='r',
+                                  shape=(len(self.labels), self.dim))
+        return self._map
+
+    def live_embeddings(self):
+        """(float32 matrix, labels) of the live rows, in insertion order."""
+        with self._lock:
+            self.refresh()
+            rows = np.flatnonzero(self._alive)
+            if not len(rows):
+                return np.zeros((0, self.dim or 0), dtype=np.float32), []
+            return np.asarray(self._matrix()[rows]), [self.labels[row] for row in rows]
+
+    def snapshot(self):
+        """(version, matrix, labels) of the live rows, with the version they were read at."""
+        with self._lock:
+            vectors, labels = self.live_embeddings()
+            return (self.generation, self._log_offset), vectors, labels
+
+    def embeddings_of(self, label):
+        with self._lock:
+            self.refresh()
+            rows = self._rows_by_label.get(label, [])
+            if not rows:
+                return np.zeros((0, self.dim or 0), dtype=np.float32)
+            return np.asarray(self._matrix()[rows])
+
+    def _maybe_compact(self):
+        total = len(self.labels)
+        dead = total - sum(len(rows) for rows in self._rows_by_label.values())
+        if total >= self.min_compact_rows and dead > self.compact_ratio * total:
+            self._compact()
+
+    def compact(self):
+        """Rewrites only the live rows into a new generation and drops the old files."""
+        with self._writing():
+            self._compact()
+
+    def _compact(self):
+        old_generation, generation = self.generation, self.generation + 1
+        rows = np.flatnonzero(self._alive)
+        with open(self._embeddings_path(generation), 'wb') as f:
+            for start in range(0, len(rows), 4096):
+                f.write(np.ascontiguousarray(self._matrix()[rows[start:start + 4096]]).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        with open(self._log_path(generation), 'w') as f:
+            if len(rows):
+                f.write(json.dumps({'op': 'add', 'start': 0, 'dim': self.dim,
+                                    'labels': [self.labels[row] for row in rows]}) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+        tmp_path = os.path.join(self.directory, 'CURRENT.tmp')
+        with open(tmp_path, 'w') as f:
+            f.write(str(generation))
+        os.replace(tmp_path, os.path.join(self.directory, 'CURRENT'))
+        self.refresh()
+
+        for path in (self._embeddings_path(old_generation), self._log_path(old_generation)):
+            try:
+                os.remove(path)
+            except OSError:  # still mapped by a reader on Windows; it is unused from now on
+                pass
+        print(f"✅ Face store compacted to {len(rows)} embeddings (generation {generation}).")
+
+    def import_pickles(self, faces_path='data/faces_data.pkl', names_path='data/names_data.pkl'):
+        """One-off migration of the old pickle files into an empty store."""
+        if not (os.path.exists(faces_path) and os.path.exists(names_path)):
+            return 0
+        with self._writing():
+            if self.labels:
+                return 0
+            with open(faces_path, 'rb') as f:
+                faces = pickle.load(f)
+            with open(names_path, 'rb') as f:
+                names = list(pickle.load(f))
+            if not names:
+                return 0
+            self._append_log([self._append_rows(faces, names)])
+        count = len(names)
+        print(f"✅ Imported {count} face embeddings from {faces_path}.")
+        return count
+
+    def stats(self):
+        with self._lock:
+            self.refresh()
+            live = sum(len(rows) for rows in self._rows_by_label.values())
+            return {
+                'generation': self.generation,
+                'rows': len(self.labels),
+                'live_rows': live,
+                'identities': len(self._rows_by_label),
+                'dim': self.dim,
+            }
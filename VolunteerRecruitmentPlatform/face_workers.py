@@ -0,0 +1,160 @@
+import heapq
+import itertools
+import math
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import face_models
+
+# Lower runs first: attendance scans go ahead of enrollment uploads waiting in the queue
+ATTENDANCE = 0
+ENROLLMENT = 1
+
+# Worker processes for DeepFace; 0 runs face jobs inline on the request thread
+FACE_WORKERS = int(os.environ.get('FACE_WORKERS', 2))
+# Workers start as fresh interpreters ('spawn', or 'forkserver'), never by forking the server: it already
+# runs request, dispatcher and Firestore threads, which a forked child would inherit mid-state
+FACE_START_METHOD = os.environ.get('FACE_START_METHOD', 'spawn')
+# Jobs allowed to wait per priority before requests are turned away with 429
+FACE_QUEUE_LIMIT = int(os.environ.get('FACE_QUEUE_LIMIT', 8))
+# Seconds a request waits for its job, queueing included
+FACE_JOB_TIMEOUT = float(os.environ.get('FACE_JOB_TIMEOUT', 30))
+
+
+class PoolBusy(Exception):
+    """The queue for a priority is full; retry_after is a rough wait in seconds."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Face recognition is busy, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+
+def _worker_status():
+    return dict(face_models.model_status, pid=os.getpid())
+
+
+class FaceWorkerPool:
+    """Runs face jobs in preloaded worker processes, highest priority first.
+
+    Jobs wait in the parent in a priority heap bounded per priority; one
+    dispatcher thread per worker hands the next job over only when a worker is
+    free, so a queued scan never waits behind enrollments submitted earlier.
+    A job already running is not interrupted when its caller times out.
+
+    Spawned workers re-import the launching script as __mp_main__, so a
+    server must create the pool (and its other threads) from a function run
+    under __main__ or on first request, not at import.
+    """
+
+    def __init__(self, workers=FACE_WORKERS, queue_limit=FACE_QUEUE_LIMIT, timeout=FACE_JOB_TIMEOUT,
+                 start_method=FACE_START_METHOD):
+        if start_method not in ('spawn', 'forkserver'):
+            raise ValueError(f"Face workers must start with 'spawn' or 'forkserver', not {start_method!r}")
+        self.workers = workers
+        self.start_method = start_method
+        self.queue_limit = queue_limit
+        self.timeout = timeout
+        self._heap = []
+        self._waiting = {}
+        self._sequence = itertools.count()
+        self._cond = threading.Condition()
+        self._job_seconds = 2.0  # running average, for Retry-After
+        self.completed = 0
+        self.rejected = 0
+        self._executor = None
+        if workers:
+            self._executor = self._new_executor()
+            for i in range(workers):
+                threading.Thread(target=self._dispatch, name=f'face-dispatch-{i}', daemon=True).start()
+
+    def _new_executor(self):
+        return ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context(self.start_method),
+                                   initializer=face_models.preload_models)
+
+    def start(self):
+        """Warms the models: in every worker process, or in this process when running inline."""
+        if not self.workers:
+            face_models.start_preload()
+            return
+        face_models.model_status['loading'] = True
+        warmed = []
+
+        def record(future):
+            warmed.append(future.exception() or future.result())
+            if len(warmed) < self.workers:
+                return
+            errors = [str(w) if isinstance(w, BaseException) else w['error'] for w in warmed]
+            errors = [e for e in errors if e]
+            face_models.set_status({'ready': not errors, 'loading': False, 'error': '; '.join(errors) or None,
+                                    'seconds': max((w['seconds'] or 0 for w in warmed if isinstance(w, dict)),
+                                                   default=None)})
+
+        for _ in range(self.workers):
+            self._executor.submit(_worker_status).add_done_callback(record)
+
+    def submit(self, priority, func, *args):
+        """Queues func(*args) and returns its Future, or raises PoolBusy if that priority's queue is full."""
+        future = Future()
+        with self._cond:
+            if self._waiting.get(priority, 0) >= self.queue_limit:
+                self.rejected += 1
+                raise PoolBusy(self._retry_after(priority))
+            self._waiting[priority] = self._waiting.get(priority, 0) + 1
+            heapq.heappush(self._heap, (priority, next(self._sequence), func, args, future))
+            self._cond.notify()
+        return future
+
+    def run(self, priority, func, *args):
+        """func(*args) from a worker, or inline without workers.
+
+        Raises PoolBusy when the queue is full and concurrent.futures.TimeoutError
+        when no result arrives within the timeout.
+        """
+        if not self.workers:
+            return func(*args)
+        future = self.submit(priority, func, *args)
+        try:
+            return future.result(timeout=self.timeout)
+        finally:
+            future.cancel()  # still queued: drop it rather than run it for nobody
+
+    def _retry_after(self, priority):
+        ahead = sum(count for p, count in self._waiting.items() if p <= priority) + self.workers
+        return max(1, math.ceil(ahead * self._job_seconds / self.workers))
+
+    def _dispatch(self):
+        while True:
+            with self._cond:
+                while not self._heap:
+                    self._cond.wait()
+                priority, _, func, args, future = heapq.heappop(self._heap)
+                self._waiting[priority] -= 1
+            if not future.set_running_or_notify_cancel():
+                continue
+
+            started = time.perf_counter()
+            executor = self._executor
+            try:
+                future.set_result(executor.submit(func, *args).result())
+            except BrokenProcessPool as e:
+                # A worker died (e.g. out of memory): replace the pool for the jobs behind this one
+                with self._cond:
+                    if self._executor is executor:
+                        print(f"⚠️ Face worker pool broke, restarting: {e}")
+                        self._executor = self._new_executor()
+                future.set_exception(e)
+            except Exception as e:
+                future.set_exception(e)
+            with self._cond:
+                self._job_seconds = 0.8 * self._job_seconds + 0.2 * (time.perf_counter() - started)
+                self.completed += 1
+
+    def stats(self):
+        with self._cond:
+            return {'workers': self.workers, 'queued': {p: n for p, n in self._waiting.items() if n},
+                    'completed': self.completed, 'rejected': self.rejected,
+                    'avg_job_seconds': round(self._job_seconds, 3)}
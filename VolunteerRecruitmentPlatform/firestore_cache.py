@@ -0,0 +1,253 @@
+import threading
+import time
+
+
+class SnapshotCache:
+    """Process-wide TTL cache for whole-collection Firestore snapshots.
+
+    Each key (e.g. 'Event') holds the last list of documents returned by its
+    loader. Only one thread refreshes a key at a time; while a refresh is in
+    flight other requests keep serving the previous snapshot, or wait for it
+    if there is none yet. Cached snapshots are shared, so callers must treat
+    them as read-only.
+    """
+
+    def __init__(self, ttl_seconds=60):
+        self.ttl_seconds = ttl_seconds
+        self._entries = {}
+        self._locks = {}
+        self._guard = threading.Lock()
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'stale_hits': 0,
+            'refreshes': 0,
+            'refresh_errors': 0,
+            'refresh_seconds_total': 0.0,
+            'refresh_seconds_max': 0.0,
+            'refresh_seconds_last': 0.0,
+        }
+
+    def _lock_for(self, key):
+        with self._guard:
+            if key not in self._locks:
+                self._locks[key] = threading.Lock()
+            return self._locks[key]
+
+    def _is_fresh(self, entry):
+        return entry is not None and time.monotonic() - entry[1] < self.ttl_seconds
+
+    def _count(self, name, amount=1):
+        with self._guard:
+            self._stats[name] += amount
+
+    def get(self, key, loader):
+        """Returns the cached snapshot for key, calling loader() when it has expired."""
+        entry = self._entries.get(key)
+        if self._is_fresh(entry):
+            self._count('hits')
+            return entry[0]
+
+        lock = self._lock_for(key)
+        # Another request is already reloading this key: serve the stale copy
+        if entry is not None and not lock.acquire(blocking=False):
+            self._count('stale_hits')
+            return entry[0]
+        if entry is None:
+            lock.acquire()
+
+        try:
+            # Re-check after taking the lock, a concurrent refresh may have finished
+            entry = self._entries.get(key)
+            if self._is_fresh(entry):
+                self._count('hits')
+                return entry[0]
+
+            self._count('misses')
+            started = time.perf_counter()
+            try:
+                value = loader()
+            except Exception:
+                self._count('refresh_errors')
+                raise
+            elapsed = time.perf_counter() - started
+
+            self._entries[key] = (value, time.monotonic())
+            with self._guard:
+                self._stats['refreshes'] += 1
+                self._stats['refresh_seconds_total'] += elapsed
+                self._stats['refresh_seconds_last'] = elapsed
+                self._stats['refresh_seconds_max'] = max(self._stats['refresh_seconds_max'], elapsed)
+            return value
+        finally:
+            lock.release()
+
+    def invalidate(self, key=None):
+        """Drops one key, or every key when key is None, so the next read reloads it."""
+        if key is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(key, None)
+
+    def stats(self):
+        """Returns a copy of the hit/miss counters and refresh latencies."""
+        with self._guard:
+            stats = dict(self._stats)
+        refreshes = stats['refreshes']
+        stats['refresh_seconds_avg'] = stats['refresh_seconds_total'] / refreshes if refreshes else 0.0
+        stats['ttl_seconds'] = self.ttl_seconds
+        stats['keys'] = {
+            key: {'size': len(value), 'age_seconds': time.monotonic() - loaded_at}
+            for key, (value, loaded_at) in list(self._entries.items())
+        }
+        return stats
+
+
+class LiveCollection:
+    """Local copy of a Firestore collection kept current by on_snapshot deltas.
+
+    The first snapshot delivers every document as ADDED; after that only the
+    changed documents arrive, so keeping the copy current costs O(changes)
+    rather than a full stream() per refresh. Works with any object exposing
+    on_snapshot(callback), including ReplayCollection below.
+    """
+
+    def __init__(self, collection, id_field):
+        self.collection = collection
+        self.id_field = id_field
+        self.version = 0
+        self.ready = threading.Event()
+        self._docs = {}
+        self._snapshot = []
+        self._snapshot_version = 0
+        self._lock = threading.Lock()
+        self._watch = None
+        self._listeners = []
+
+    def start(self):
+        self._watch = self.collection.on_snapshot(self._on_snapshot)
+        return self
+
+    def stop(self):
+        if self._watch is not None:
+            self._watch.unsubscribe()
+            self._watch = None
+
+    def _on_snapshot(self, col_snapshot, changes, read_time):
+        self.apply_changes(changes)
+        self.ready.set()
+
+    def add_listener(self, listener):
+        """Registers listener(deltas) for (type_name, doc_id, data) deltas.
+
+        Documents already held locally are replayed to it as ADDED first, so a
+        listener attached after start() still sees the whole collection.
+        """
+        with self._lock:
+            current = [('ADDED', doc_id, data) for doc_id, data in self._docs.items()]
+            if current:
+                listener(current)
+            self._listeners.append(listener)
+
+    def apply_changes(self, changes):
+        """Applies ADDED/MODIFIED/REMOVED document changes to the local copy."""
+        with self._lock:
+            deltas = []
+            for change in changes:
+                doc = change.document
+                if change.type.name == 'REMOVED':
+                    data = self._docs.pop(doc.id, None)
+                else:
+                    data = {self.id_field: doc.id, **doc.to_dict()}
+                    self._docs[doc.id] = data
+                deltas.append((change.type.name, doc.id, data))
+            if changes:
+                self.version += 1
+                for listener in self._listeners:
+                    listener(deltas)
+
+    def snapshot(self):
+        """Returns the current documents as a list; rebuilt only after a change."""
+        with self._lock:
+            if self._snapshot_version != self.version:
+                self._snapshot = list(self._docs.values())
+                self._snapshot_version = self.version
+            return self._snapshot
+
+    def __len__(self):
+        return len(self._docs)
+
+
+class _ChangeType:
+    def __init__(self, name):
+        self.name = name
+
+
+class _Document:
+    def __init__(self, doc_id, data):
+        self.id = doc_id
+        self._data = data
+
+    def to_dict(self):
+        return dict(self._data)
+
+
+class _DocumentChange:
+    def __init__(self, type_name, doc_id, data):
+        self.type = _ChangeType(type_name)
+        self.document = _Document(doc_id, data)
+
+
+class _Watch:
+    def __init__(self, owner, callback):
+        self._owner = owner
+        self._callback = callback
+
+    def unsubscribe(self):
+        self._owner._listeners.remove(self._callback)
+
+
+class ReplayCollection:
+    """In-process stand-in for a Firestore collection that replays change events.
+
+    Lets LiveCollection (and the recommenders reading from it) run without a
+    Firestore project or emulator, e.g. seeded from the CSV exports.
+    """
+
+    def __init__(self, documents=None):
+        self._docs = dict(documents or {})
+        self._listeners = []
+
+    def on_snapshot(self, callback):
+        self._listeners.append(callback)
+        changes = [_DocumentChange('ADDED', doc_id, data) for doc_id, data in self._docs.items()]
+        callback(None, changes, None)
+        return _Watch(self, callback)
+
+    def stream(self):
+        return [_Document(doc_id, data) for doc_id, data in list(self._docs.items())]
+
+    def _emit(self, changes):
+        for callback in list(self._listeners):
+            callback(None, changes, None)
+
+    def set(self, doc_id, data):
+        change_type = 'MODIFIED' if doc_id in self._docs else 'ADDED'
+        self._docs[doc_id] = data
+        self._emit([_DocumentChange(change_type, doc_id, data)])
+
+    def delete(self, doc_id):
+        data = self._docs.pop(doc_id, None)
+        if data is not None:
+            self._emit([_DocumentChange('REMOVED', doc_id, data)])
+
+    def replay(self, changes):
+        """Replays a batch of (type_name, doc_id, data) tuples as one snapshot."""
+        batch = []
+        for type_name, doc_id, data in changes:
+            if type_name == 'REMOVED':
+                self._docs.pop(doc_id, None)
+            else:
+                self._docs[doc_id] = data
+            batch.append(_DocumentChange(type_name, doc_id, data))
+        self._emit(batch)
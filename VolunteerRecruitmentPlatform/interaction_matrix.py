@@ -0,0 +1,413 @@
+import heapq
+import threading
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+
+from ann_index import make_index
+
+INTERACTION_WEIGHTS = {
+    'view': 0.5,
+    'review': 2,
+    'watchlisted': 3,
+    'enquiry': 4,
+    'apply': 5
+}
+
+
+def top_k_indices(scores, k):
+    """Row-wise column indices of the k largest scores, highest first."""
+    k = min(k, scores.shape[1])
+    if k <= 0:
+        return np.empty((scores.shape[0], 0), dtype=int)
+    candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(scores, candidates, axis=1), axis=1, kind='stable')
+    return np.take_along_axis(candidates, order, axis=1)
+
+
+def neighbour_scan_order(matrix, neighbour_rows):
+    """For each row of neighbour_rows (batch x neighbours), the position at which a
+    neighbour-by-neighbour, column-by-column scan of matrix first meets each column.
+
+    Columns no neighbour has are at the int64 maximum. Used to break score ties
+    the way the original per-user loop did.
+    """
+    neighbour_rows = np.atleast_2d(np.asarray(neighbour_rows, dtype=int))
+    batch, per_user = neighbour_rows.shape
+    neighbours = matrix[neighbour_rows.ravel()]
+    counts = np.diff(neighbours.indptr)
+    positions = np.repeat(np.tile(np.arange(per_user), batch), counts)
+    owners = np.repeat(np.repeat(np.arange(batch), per_user), counts)
+    first_seen = np.full((batch, matrix.shape[1]), np.iinfo(np.int64).max)
+    np.minimum.at(first_seen, (owners, neighbours.indices), positions * matrix.shape[1] + neighbours.indices)
+    return first_seen
+
+
+def top_k_by_scan_order(scores, first_seen, k):
+    """Row-wise columns of the k highest positive scores, ties in scan order (see neighbour_scan_order)."""
+    order = np.lexsort((first_seen, -scores), axis=-1)[:, :k]
+    return [row[scores[i, row] > 0] for i, row in enumerate(order)]
+
+
+def aggregate_neighbour_scores(matrix, neighbour_rows, weights=None, exclude_cols=None, k=None):
+    """Sums neighbour rows of a CSR user x event matrix with one sparse matrix-vector product.
+
+    weights scale each neighbour's row (e.g. by similarity) and exclude_cols
+    masks events the user has already seen. Returns (cols, scores) of the top-k
+    positive events, best first; ties keep the order in which a
+    neighbour-by-neighbour, column-by-column scan would first meet them.
+    """
+    neighbour_rows = np.asarray(neighbour_rows, dtype=int).ravel()
+    weights = np.ones(len(neighbour_rows)) if weights is None else np.asarray(weights, dtype=float).ravel()
+    user_weights = np.zeros(matrix.shape[0])
+    np.add.at(user_weights, neighbour_rows, weights)
+    scores = matrix.T @ user_weights
+
+    candidates = scores > 0
+    if exclude_cols is not None:
+        candidates[np.asarray(exclude_cols, dtype=int)] = False
+    candidates = np.flatnonzero(candidates)
+    if k is not None and len(candidates) > k:
+        kth = np.partition(-scores[candidates], k - 1)[k - 1]
+        candidates = candidates[-scores[candidates] <= kth]
+
+    # Position of each event in the scan order, to break score ties like the loop did
+    first_seen = neighbour_scan_order(matrix, neighbour_rows)[0]
+
+    order = np.lexsort((first_seen[candidates], -scores[candidates]))
+    if k is not None:
+        order = order[:k]
+    return candidates[order], scores[candidates[order]]
+
+
+def to_naive_timestamp(value):
+    """Parses a Firestore/ISO timestamp and drops its timezone, as the pandas pipeline did."""
+    timestamp = pd.Timestamp(value)
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.tz_localize(None)
+    return timestamp
+
+
+class InteractionMatrix:
+    """Sparse userId x eventId matrix of weighted interactions inside a rolling window.
+
+    Built directly from (user, event, weight) triples through index dicts, so
+    memory and build time follow the number of interactions rather than
+    users x events. New, modified and removed interactions are applied as
+    sparse deltas, and contributions older than the window are expired from a
+    timestamp heap.
+    """
+
+    def __init__(self, window_days=28, weights=INTERACTION_WEIGHTS, id_field='User ID'):
+        self.window = timedelta(days=window_days)
+        self.weights = weights
+        self.id_field = id_field
+        self.version = 0
+        self.generation = 0
+        self.lock = threading.RLock()
+        self._source = None
+        self._reset()
+
+    def _reset(self):
+        self.user_ids = []
+        self.event_ids = []
+        self.user_row = {}
+        self.event_col = {}
+        self._matrix = csr_matrix((0, 0))
+        self._pending = []
+        self._contributions = {}  # interaction id -> (row, col, weight, timestamp)
+        self._expiry = []  # heap of (timestamp, interaction id)
+        self._touched = set()
+        self.touched_at = {}  # user id -> version of its last change
+
+    def _row(self, user_id):
+        row = self.user_row.get(user_id)
+        if row is None:
+            row = self.user_row[user_id] = len(self.user_ids)
+            self.user_ids.append(user_id)
+        return row
+
+    def _col(self, event_id):
+        col = self.event_col.get(event_id)
+        if col is None:
+            col = self.event_col[event_id] = len(self.event_ids)
+            self.event_ids.append(event_id)
+        return col
+
+    def _cutoff(self, now=None):
+        return (now or datetime.now()) - self.window
+
+    def _add(self, interaction_id, data, cutoff):
+        weight = self.weights.get(data.get('type'))
+        if weight is None or data.get('userId') is None or data.get('eventId') is None:
+            return
+        try:
+            timestamp = to_naive_timestamp(data.get('timestamp'))
+        except (TypeError, ValueError) as e:
+            print(f"⚠️ Skipping interaction {interaction_id} with bad timestamp: {e}")
+            return
+        if pd.isna(timestamp) or timestamp < cutoff:
+            return
+
+        row, col = self._row(data['userId']), self._col(data['eventId'])
+        self._contributions[interaction_id] = (row, col, weight, timestamp)
+        heapq.heappush(self._expiry, (timestamp, interaction_id))
+        self._pending.append((row, col, weight))
+        self._touched.add(data['userId'])
+
+    def _remove(self, interaction_id):
+        contribution = self._contributions.pop(interaction_id, None)
+        if contribution is not None:
+            row, col, weight, _ = contribution
+            self._pending.append((row, col, -weight))
+            self._touched.add(self.user_ids[row])
+
+    def _bump_version(self):
+        if self._touched:
+            self.version += 1
+            for user_id in self._touched:
+                self.touched_at[user_id] = self.version
+            self._touched = set()
+
+    def load(self, interactions):
+        """Rebuilds the matrix from a full list of interaction dicts."""
+        with self.lock:
+            self._reset()
+            interactions_df = pd.DataFrame(interactions)
+            if not interactions_df.empty:
+                interactions_df = interactions_df[interactions_df['type'].isin(self.weights.keys())]
+                timestamps = pd.to_datetime(interactions_df['timestamp'])
+                if timestamps.dt.tz is not None:
+                    timestamps = timestamps.dt.tz_localize(None)
+                interactions_df = interactions_df.assign(timestamp=timestamps)
+                interactions_df = interactions_df[interactions_df['timestamp'] >= self._cutoff()]
+
+                rows = np.fromiter((self._row(u) for u in interactions_df['userId']), dtype=np.int64,
+                                   count=len(interactions_df))
+                cols = np.fromiter((self._col(e) for e in interactions_df['eventId']), dtype=np.int64,
+                                   count=len(interactions_df))
+                weights = interactions_df['type'].map(self.weights).to_numpy(dtype=float)
+                self._matrix = csr_matrix((weights, (rows, cols)), shape=(len(self.user_ids), len(self.event_ids)))
+
+                for interaction_id, row, col, weight, timestamp in zip(
+                        interactions_df[self.id_field], rows, cols, weights, interactions_df['timestamp']):
+                    self._contributions[interaction_id] = (row, col, weight, timestamp)
+                    self._expiry.append((timestamp, interaction_id))
+                heapq.heapify(self._expiry)
+            self._source = interactions
+            self.version += 1
+            self.generation += 1
+
+    def sync(self, interactions):
+        """Reloads from a snapshot list only when it is a different snapshot than last time."""
+        with self.lock:
+            if interactions is not self._source:
+                self.load(interactions)
+
+    def apply_changes(self, deltas):
+        """Applies (type_name, interaction_id, data) deltas, e.g. from LiveCollection."""
+        with self.lock:
+            cutoff = self._cutoff()
+            for type_name, interaction_id, data in deltas:
+                self._remove(interaction_id)
+                if type_name != 'REMOVED' and data is not None:
+                    self._add(interaction_id, data, cutoff)
+            self._bump_version()
+
+    def expire(self, now=None):
+        """Rolls the window forward, removing contributions older than it."""
+        with self.lock:
+            cutoff = self._cutoff(now)
+            while self._expiry and self._expiry[0][0] < cutoff:
+                timestamp, interaction_id = heapq.heappop(self._expiry)
+                contribution = self._contributions.get(interaction_id)
+                # Heap entries of removed or re-added interactions are skipped lazily
+                if contribution is not None and contribution[3] == timestamp:
+                    self._remove(interaction_id)
+            self._bump_version()
+
+    def changed_users(self, since_version):
+        """User ids whose interactions changed after since_version."""
+        with self.lock:
+            return {user_id for user_id, version in self.touched_at.items() if version > since_version}
+
+    def _flush(self):
+        shape = (len(self.user_ids), len(self.event_ids))
+        if self._matrix.shape != shape:
+            self._matrix.resize(shape)
+        if not self._pending:
+            return
+        rows, cols, weights = zip(*self._pending)
+        self._pending = []
+        delta = csr_matrix((weights, (rows, cols)), shape=shape)
+        matrix = (self._matrix + delta).tocsr()
+        matrix.data[np.abs(matrix.data) < 1e-9] = 0
+        matrix.eliminate_zeros()
+        self._matrix = matrix
+
+    def matrix(self, event_ids=None, now=None):
+        """Returns (csr, user_ids, event_ids) for the current window.
+
+        Columns are limited to event_ids when given; ids are sorted and users
+        without any remaining interaction are dropped, like the old pivot.
+        """
+        with self.lock:
+            self.expire(now)
+            self._flush()
+            if event_ids is None:
+                event_ids = self.event_ids
+            cols = sorted((event_id, self.event_col[event_id]) for event_id in set(event_ids)
+                          if event_id in self.event_col)
+            matrix = self._matrix[:, [col for _, col in cols]].tocsr()
+
+            active_rows = np.flatnonzero(np.diff(matrix.indptr))
+            rows = sorted((self.user_ids[row], row) for row in active_rows)
+            matrix = matrix[[row for _, row in rows]]
+            matrix.sort_indices()
+            return matrix, [user_id for user_id, _ in rows], [event_id for event_id, _ in cols]
+
+
+class UserNeighbourIndex:
+    """Top-k most similar users per user, by cosine over binary user x event rows.
+
+    Similarities are computed in row blocks, so memory is bounded by
+    block_size x users instead of users x users, and only the k best positive
+    neighbours of each user are kept. refresh() recomputes just the users
+    whose interactions changed plus the rows whose lists they affect.
+    """
+
+    def __init__(self, k=5, block_size=1024):
+        self.k = k
+        self.block_size = block_size
+        self.neighbours = {}  # user id -> [(neighbour id, similarity), ...] best first
+        self._listed_by = {}  # neighbour id -> user ids whose lists contain it
+        self._generation = None
+        self._version = -1
+        self._event_ids = None
+        self._lock = threading.Lock()
+
+    def similar_users(self, user_id, top_n=5):
+        return [neighbour_id for neighbour_id, _ in self.neighbours.get(user_id, [])[:top_n]]
+
+    @staticmethod
+    def _normalise(interaction_matrix_csr):
+        binary = interaction_matrix_csr.copy().astype(float)
+        binary.data[:] = 1
+        norms = np.sqrt(np.asarray(binary.sum(axis=1)).ravel())
+        norms[norms == 0] = 1
+        binary.data /= np.repeat(norms, np.diff(binary.indptr))
+        return binary
+
+    def _set(self, user_id, entries):
+        for neighbour_id, _ in self.neighbours.get(user_id, []):
+            self._listed_by.get(neighbour_id, set()).discard(user_id)
+        self.neighbours[user_id] = entries
+        for neighbour_id, _ in entries:
+            self._listed_by.setdefault(neighbour_id, set()).add(user_id)
+
+    def _drop(self, user_id):
+        self._set(user_id, [])
+        del self.neighbours[user_id]
+
+    def _compute_rows(self, normalised, user_ids, rows):
+        for start in range(0, len(rows), self.block_size):
+            block_rows = rows[start:start + self.block_size]
+            sims = (normalised[block_rows] @ normalised.T).toarray()
+            sims[np.arange(len(block_rows)), block_rows] = 0
+            top = top_k_indices(sims, self.k)
+            for i, row in enumerate(block_rows):
+                self._set(user_ids[row], [(user_ids[col], float(sims[i, col])) for col in top[i] if sims[i, col] > 0])
+
+    def refresh(self, interaction_store, event_ids=None):
+        """Brings the index up to date with interaction_store, returning it."""
+        with self._lock:
+            return self._refresh(interaction_store, event_ids)
+
+    def _refresh(self, interaction_store, event_ids):
+        with interaction_store.lock:
+            interaction_matrix_csr, user_ids, matrix_event_ids = interaction_store.matrix(event_ids)
+            version, generation = interaction_store.version, interaction_store.generation
+            if version == self._version and generation == self._generation and matrix_event_ids == self._event_ids:
+                return self
+            full = generation != self._generation or matrix_event_ids != self._event_ids
+            changed = set() if full else interaction_store.changed_users(self._version)
+
+        normalised = self._normalise(interaction_matrix_csr)
+        row_of = {user_id: row for row, user_id in enumerate(user_ids)}
+        if full or len(changed) * 4 > len(user_ids):
+            self.neighbours, self._listed_by = {}, {}
+            self._compute_rows(normalised, user_ids, list(range(len(user_ids))))
+        else:
+            self._refresh_partial(normalised, user_ids, row_of, changed)
+
+        self._version, self._generation, self._event_ids = version, generation, matrix_event_ids
+        return self
+
+    def _refresh_partial(self, normalised, user_ids, row_of, changed):
+        removed = {user_id for user_id in self.neighbours if user_id not in row_of}
+        changed = {user_id for user_id in changed if user_id in row_of}
+        changed |= {user_id for user_id in user_ids if user_id not in self.neighbours}
+        stale = changed | removed
+
+        affected = set()
+        for user_id in stale:
+            affected |= self._listed_by.get(user_id, set())
+        for user_id in removed:
+            self._drop(user_id)
+        changed_rows = sorted(row_of[user_id] for user_id in changed)
+        new_sims = (normalised @ normalised[changed_rows].T).tocsr() if changed_rows else None
+        if new_sims is not None:
+            affected |= {user_ids[row] for row in np.flatnonzero(np.diff(new_sims.indptr))}
+        affected -= stale
+
+        recompute = list(changed_rows)
+        for user_id in affected:
+            row = row_of[user_id]
+            old = self.neighbours.get(user_id, [])
+            candidates = [(n, sim) for n, sim in old if n not in stale]
+            if new_sims is not None:
+                sims_row = new_sims[row]
+                candidates += [(user_ids[changed_rows[j]], float(sim))
+                               for j, sim in zip(sims_row.indices, sims_row.data)
+                               if sim > 0 and changed_rows[j] != row]
+            candidates.sort(key=lambda entry: entry[1], reverse=True)
+            # A full list that lost members may now need users it never saw
+            if len(old) >= self.k and sum(sim >= old[-1][1] for _, sim in candidates) < self.k:
+                recompute.append(row)
+            else:
+                self._set(user_id, candidates[:self.k])
+        self._compute_rows(normalised, user_ids, sorted(set(recompute)))
+
+
+class UserSearchIndex:
+    """A k-NN index over the user x event matrix, refitted only when the matrix changes.
+
+    The fit is keyed on the store's generation and version plus the event-id
+    column order; get() returns the index together with the matrix and ids it
+    was fitted on, so query rows and neighbour indices always agree.
+    """
+
+    def __init__(self, spec='exact', metric='cosine'):
+        self.spec = spec
+        self.metric = metric
+        self.fits = 0
+        self._key = None
+        self._state = None
+        self._lock = threading.Lock()
+
+    def get(self, interaction_store, event_ids=None):
+        """(index, csr, user_ids, event_ids) for the store's current matrix."""
+        with self._lock:
+            with interaction_store.lock:
+                interaction_matrix_csr, user_ids, matrix_event_ids = interaction_store.matrix(event_ids)
+                key = (interaction_store.generation, interaction_store.version, tuple(matrix_event_ids))
+            if key != self._key:
+                index = make_index(self.spec, metric=self.metric)
+                if interaction_matrix_csr.nnz:
+                    index.fit(interaction_matrix_csr)
+                self._state = (index, interaction_matrix_csr, user_ids, matrix_event_ids)
+                self._key = key
+                self.fits += 1
+            return self._state
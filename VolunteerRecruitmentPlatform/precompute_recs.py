@@ -0,0 +1,47 @@
+import argparse
+import time
+
+from rec import batch_recommend, fetch_users_data, popularity_based_recommendation
+from rec_store import POPULARITY_KEY, write_recommendations
+
+
+def volunteer_ids(users):
+    return [user['User ID'] for user in users if user.get('role', 'volunteer') == 'volunteer']
+
+
+def build_rows(user_ids, top_n, batch_size):
+    """Yields (user_id, method, recommendations) for every volunteer and pipeline."""
+    popular = popularity_based_recommendation(top_n)
+    if isinstance(popular, dict):
+        print(f"⚠️ Popularity list not stored: {popular.get('error')}")
+    yield POPULARITY_KEY, 'popularity', popular
+    for method in ('content', 'collaborative', 'hybrid'):
+        for start in range(0, len(user_ids), batch_size):
+            batch = user_ids[start:start + batch_size]
+            output = batch_recommend(batch, top_n, method)
+            print(f"{method}: {start + len(batch)}/{len(user_ids)} users "
+                  f"({output['users_per_second']:.0f} users/s)")
+            for user_id, recommendations in output['results'].items():
+                yield user_id, method, recommendations
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Precompute top-N recommendations for every volunteer.')
+    parser.add_argument('--top-n', type=int, default=20)
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--output', default='data/recommendations.db')
+    args = parser.parse_args()
+
+    users = fetch_users_data()
+    if isinstance(users, dict):
+        raise SystemExit(users['error'])
+
+    started = time.perf_counter()
+    user_ids = volunteer_ids(users)
+    count = write_recommendations(args.output, build_rows(user_ids, args.top_n, args.batch_size), args.top_n)
+    print(f"✅ Stored {count} recommendation lists for {len(user_ids)} volunteers "
+          f"in {time.perf_counter() - started:.1f}s.")
+
+
+if __name__ == '__main__':
+    main()
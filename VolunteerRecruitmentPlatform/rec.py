@@ -4,30 +4,30 @@ from firebase_admin import credentials, firestore
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 import numpy as np
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.neighbors import NearestNeighbors
 from datetime import datetime, timedelta
 from scipy.sparse import csr_matrix
-import cv2
-import pickle
 import os
-from deepface import DeepFace
-from sklearn.neighbors import KNeighborsClassifier
+import time
+from concurrent.futures import ThreadPoolExecutor
+from face_pipeline import FACE_MAX_REQUEST_BYTES
+from firestore_cache import SnapshotCache, LiveCollection
+from event_index import EventContentIndex
+from rec_store import POPULARITY_KEY, RecommendationStore
+import face_routes
+from interaction_matrix import (InteractionMatrix, UserNeighbourIndex, UserSearchIndex, aggregate_neighbour_scores,
+                                neighbour_scan_order, top_k_by_scan_order, top_k_indices)
 
 app = Flask(__name__)
 CORS(app)
+# Larger request bodies get a 413 before any of the upload is read
+app.config['MAX_CONTENT_LENGTH'] = FACE_MAX_REQUEST_BYTES
 os.makedirs('data', exist_ok=True)
 # Initialize Firebase app
 cred = credentials.Certificate("test-e6569-firebase-adminsdk-2pshh-c356a436fc.json")
 firebase_admin.initialize_app(cred)
 
-# Global variables for storing face data and names
-faces_data = []
-names_data = []
-
-# Initialize the KNN model
-knn = None
+# Registration, attendance and /health, shared with face_scan_server.py
+app.register_blueprint(face_routes.blueprint)
 
 # Firestore client
 db = firestore.client()
@@ -37,28 +37,51 @@ events_collection = db.collection('Event')
 users_collection = db.collection('User')
 interactions_collection = db.collection('Interactions')
 
+# Snapshot cache so each request does not rescan whole collections
+snapshot_cache = SnapshotCache(ttl_seconds=float(os.environ.get('SNAPSHOT_CACHE_TTL', 60)))
+
+def _stream_events():
+    return [{"eventId": event.id, **event.to_dict()} for event in events_collection.stream()]
+
+def _stream_users():
+    return [{"User ID": user.id, **user.to_dict()} for user in users_collection.stream()]
+
+def _stream_interactions():
+    return [{"User ID": interaction.id, **interaction.to_dict()} for interaction in interactions_collection.stream()]
+
+# Live local copies fed by on_snapshot deltas, listening once start_services() runs;
+# set FIRESTORE_LIVE_SYNC=0 to fall back to the TTL cache
+live_collections = {}
+if os.environ.get('FIRESTORE_LIVE_SYNC', '1') != '0':
+    live_collections = {
+        'Event': LiveCollection(events_collection, 'eventId'),
+        'User': LiveCollection(users_collection, 'User ID'),
+        'Interactions': LiveCollection(interactions_collection, 'User ID'),
+    }
+
+def read_collection(name, loader):
+    """Reads from the live store once its first snapshot arrived, otherwise from the TTL cache."""
+    live = live_collections.get(name)
+    if live is not None and live.ready.is_set():
+        return live.snapshot()
+    return snapshot_cache.get(name, loader)
+
 # Fetch data from Firestore
 def fetch_events_data():
     try:
-        events_ref = events_collection.stream()
-        events = [{"eventId": event.id, **event.to_dict()} for event in events_ref]
-        return events
+        return read_collection('Event', _stream_events)
     except Exception as e:
         return {"error": f"Error fetching events data: {str(e)}"}
 
 def fetch_users_data():
     try:
-        users_ref = users_collection.stream()
-        users = [{"User ID": user.id, **user.to_dict()} for user in users_ref]
-        return users
+        return read_collection('User', _stream_users)
     except Exception as e:
         return {"error": f"Error fetching users data: {str(e)}"}
 
 def fetch_interactions_data():
     try:
-        interactions_ref = interactions_collection.stream()
-        interactions = [{"User ID": interaction.id, **interaction.to_dict()} for interaction in interactions_ref]
-        return interactions
+        return read_collection('Interactions', _stream_interactions)
     except Exception as e:
         return {"error": f"Error fetching interactions data: {str(e)}"}
 
@@ -81,25 +104,45 @@ def normalize_scores(scores):
         return [0 for _ in scores]
     return [(score - min_score) / (max_score - min_score) for score in scores]
 
+# TF-IDF index over upcoming events, refitted only when they change
+event_index = EventContentIndex('data/event_index.pkl')
+
+def prepare_event_content(events):
+    """Builds the eventId/title/content_features frame of upcoming events for the event index."""
+    upcoming_events_df = pd.DataFrame(get_upcoming_events(events))
+    return preprocess_text(upcoming_events_df, 'content_features')
+
+def load_recommendation_snapshot(with_interactions=True):
+    """Reads events, users and the interaction matrix once, for recommenders that share them."""
+    events = fetch_events_data()
+    upcoming_events = get_upcoming_events(events)
+    snapshot = {
+        'events': events,
+        'users': fetch_users_data(),
+        'upcoming_events': upcoming_events,
+        'events_df': pd.DataFrame(events),
+        'interactions': None,
+    }
+    if with_interactions:
+        try:
+            snapshot['interactions'] = current_interaction_matrix([event['eventId'] for event in upcoming_events])
+        except Exception as e:
+            snapshot['interactions'] = e
+    return snapshot
+
 # Recommendation Functions
-def content_based_recommend(user_id, num_recommendations=20):
+def content_based_recommend(user_id, num_recommendations=20, snapshot=None):
     """Provides content-based recommendations with only upcoming events."""
     # Fetch all events and filter for upcoming events
-    events_df = fetch_events_data()
-    upcoming_events = get_upcoming_events(events_df)  # Filter for upcoming events
-    users_df = fetch_users_data()
-    # Convert upcoming_events to a DataFrame
-    upcoming_events_df = pd.DataFrame(upcoming_events)
-    
+    snapshot = snapshot or load_recommendation_snapshot(with_interactions=False)
+    events_df = snapshot['events']
+    users_df = snapshot['users']
+
     # Fetch users and interactions data
     users_df = pd.DataFrame(users_df)
 
-    # Preprocess events data to create content features
-    upcoming_events_df = preprocess_text(upcoming_events_df, 'content_features')
-
-    # Vectorize the content features using TF-IDF
-    vectorizer = TfidfVectorizer(stop_words='english')
-    tfidf_matrix = vectorizer.fit_transform(upcoming_events_df['content_features'])
+    # Vectorize the upcoming events' content features using the cached TF-IDF index
+    content_index = event_index.ensure(events_df, prepare_event_content)
 
     # Get user data and make sure the user exists
     user = users_df[users_df['User ID'] == user_id]
@@ -110,17 +153,20 @@ def content_based_recommend(user_id, num_recommendations=20):
     user_features = user['preference'].fillna('').astype(str) + ' ' + \
                     user['skills'].fillna('').astype(str) + ' ' + \
                     user['location'].fillna('').astype(str)
-    user_tfidf = vectorizer.transform(user_features)
+    user_tfidf = content_index.transform(user_features)
 
-    # Compute cosine similarity between the user and all events
-    cosine_sim = cosine_similarity(user_tfidf, tfidf_matrix).flatten()
+    # Both sides are L2-normalised, so the dot product is the cosine similarity
+    cosine_sim = content_index.score(user_tfidf).flatten()
     if cosine_sim.sum() == 0:
         return []  # Poor recommendation quality, return empty
 
     # Sort the events by similarity and select top recommendations
     event_indices = cosine_sim.argsort()[-num_recommendations:][::-1]
-    recommended_events = upcoming_events_df.iloc[event_indices][['eventId', 'title']].copy()
-    
+    recommended_events = pd.DataFrame({
+        'eventId': [content_index.event_ids[i] for i in event_indices],
+        'title': [content_index.titles[i] for i in event_indices],
+    })
+
     # Add the similarity score and normalize it
     recommended_events['Score'] = cosine_sim[event_indices]
     recommended_events['Score'] = normalize_scores(recommended_events['Score'])
@@ -129,81 +175,76 @@ def content_based_recommend(user_id, num_recommendations=20):
 
 from datetime import datetime, timedelta
 
-def collaborative_recommend(user_id, num_recommendations=20):
+# Sparse user x event interaction matrix over the 28-day window, fed by live deltas when available
+interaction_store = InteractionMatrix(window_days=28)
+if 'Interactions' in live_collections:
+    live_collections['Interactions'].add_listener(interaction_store.apply_changes)
+
+# k-NN backend for the recommenders: 'exact', 'ivf:n_lists=..,n_probe=..' or 'hnsw:ef=..' (see ann_index.py);
+# face matching has its own FACE_ANN_INDEX in face_routes.py
+COLLAB_ANN_INDEX = os.environ.get('COLLAB_ANN_INDEX', 'exact')
+
+# Top-k similar users per user, refreshed only for users whose interactions changed
+user_neighbours = UserNeighbourIndex(k=5)
+# KNN index over the same matrix for the recommenders, refitted only when the matrix changes
+user_search = UserSearchIndex(COLLAB_ANN_INDEX, metric='cosine')
+
+def current_interaction_matrix(event_ids):
+    """Returns (csr, user_ids, event_ids) of recent weighted interactions with the given events."""
+    live = live_collections.get('Interactions')
+    if live is None or not live.ready.is_set():
+        interactions = fetch_interactions_data()
+        if isinstance(interactions, dict):
+            raise ValueError(interactions['error'])
+        interaction_store.sync(interactions)
+    return interaction_store.matrix(event_ids)
+
+def collaborative_recommend(user_id, num_recommendations=20, snapshot=None):
     """Generates collaborative recommendations using KNN with interactions from the last week."""
-    interactions_df = fetch_interactions_data()
-    events_df = fetch_events_data()
-    upcoming_events = get_upcoming_events(events_df)
-    events_df = pd.DataFrame(events_df)
-    interactions_df = pd.DataFrame(interactions_df)
-    upcoming_events = pd.DataFrame(upcoming_events)
+    snapshot = snapshot or load_recommendation_snapshot()
+    events_df = snapshot['events_df']
 
-    # Filter interactions to include only upcoming events
-    interactions_df = interactions_df[interactions_df['eventId'].isin(upcoming_events['eventId'])]
-
-    try:
-        interactions_df['timestamp'] = pd.to_datetime(interactions_df['timestamp'])
-    except Exception as e:
-        return {"error": f"Failed to parse timestamps: {str(e)}"}
-
-    # Restrict interactions to the last week
-    interactions_df['timestamp'] = interactions_df['timestamp'].dt.tz_localize(None)
-    one_week_ago = datetime.now() - timedelta(days=28)
-    interactions_df = interactions_df[interactions_df['timestamp'] >= one_week_ago]
+    # Weighted interactions with upcoming events in the last 28 days
+    if isinstance(snapshot['interactions'], Exception):
+        return {"error": f"Failed to parse timestamps: {str(snapshot['interactions'])}"}
+    interaction_matrix_csr, matrix_user_ids, matrix_event_ids = snapshot['interactions']
 
     # Check if there are any interactions within the last week
-    if interactions_df.empty:
+    if interaction_matrix_csr.nnz == 0:
         return []
 
-    # Map interaction weights and aggregate scores
-    interaction_weights = {
-        'view': 0.5,
-        'review': 2,
-        'watchlisted': 3,
-        'enquiry': 4,
-        'apply': 5
-    }
-    interactions_df['Interaction'] = interactions_df['type'].map(interaction_weights)
-    interactions_df = interactions_df.groupby(['userId', 'eventId'], as_index=False).agg({'Interaction': 'sum'})
-
-    # Create user-event interaction matrix
-    interaction_matrix = interactions_df.pivot(index='userId', columns='eventId', values='Interaction').fillna(0)
-    interaction_matrix_csr = csr_matrix(interaction_matrix.values)
-
-    if user_id not in interaction_matrix.index:
+    if user_id not in matrix_user_ids:
         return []
 
     # Print similar users
-    similarity_df = calculate_user_similarity(interactions_df)
-    similar_users = get_similar_users(user_id, similarity_df, top_n=5)
+    user_neighbours.refresh(interaction_store, matrix_event_ids)
+    similar_users = get_similar_users(user_id, user_neighbours, top_n=5)
     print(f"Top 5 similar users to {user_id}: {similar_users}")
 
-    # KNN-based recommendations
-    knn = NearestNeighbors(n_neighbors=20, metric='cosine', algorithm='auto')
-    knn.fit(interaction_matrix_csr)
-    user_idx = interaction_matrix.index.get_loc(user_id)
+    # KNN-based recommendations, with the matrix the cached index was fitted on
+    knn, interaction_matrix_csr, matrix_user_ids, matrix_event_ids = user_search.get(interaction_store, matrix_event_ids)
+    if interaction_matrix_csr.nnz == 0 or user_id not in matrix_user_ids:
+        return []
+    user_idx = matrix_user_ids.index(user_id)
     user_interactions = interaction_matrix_csr[user_idx].reshape(1, -1)
 
     distances, indices = knn.kneighbors(user_interactions, n_neighbors=num_recommendations)
-    recommended_events = {}
-    for idx in indices.flatten():
-        user_events = interaction_matrix.iloc[idx]
-        for event_id, score in user_events.items():
-            if score > 0:
-                recommended_events[event_id] = recommended_events.get(event_id, 0) + score
+    # Sum the neighbours' interactions and keep the top events
+    top_cols, top_scores = aggregate_neighbour_scores(interaction_matrix_csr, indices.flatten(), k=num_recommendations)
     # Return an empty list if no recommendations exist
-    if not recommended_events:
+    if len(top_cols) == 0:
         return []
-    # Get top event recommendations
-    top_events = sorted(recommended_events.items(), key=lambda x: x[1], reverse=True)[:num_recommendations]
-    event_ids = [event[0] for event in top_events]
-    recommended_df = events_df[events_df['eventId'].isin(event_ids)][['eventId', 'title']].copy()
+    recommended_events = {matrix_event_ids[col]: score for col, score in zip(top_cols, top_scores)}
+    rank = {event_id: position for position, event_id in enumerate(recommended_events)}
+    recommended_df = events_df[events_df['eventId'].isin(rank)][['eventId', 'title']].drop_duplicates('eventId')
+    # Keep aggregate_neighbour_scores' order, which breaks score ties by scan order
+    recommended_df = recommended_df.sort_values('eventId', key=lambda ids: ids.map(rank))
     recommended_df['Score'] = [recommended_events[event_id] for event_id in recommended_df['eventId']]
     recommended_df['Score'] = normalize_scores(recommended_df['Score'])
     # Return an empty list if normalized scores are too low
     if recommended_df['Score'].max() < 0.1:
         return []
-    return recommended_df.sort_values('Score', ascending=False).to_dict(orient='records')
+    return recommended_df.to_dict(orient='records')
 
 
 def popularity_based_recommendation(num_recommendations=10):
@@ -240,30 +281,61 @@ def popularity_based_recommendation(num_recommendations=10):
 
     return recommended_events[['eventId', 'title', 'Score']].to_dict(orient='records')
 
-def hybrid_recommendation(user_id, num_recommendations=20):
-    """Combines collaborative and content-based recommendations."""
-    collaborative_recs = collaborative_recommend(user_id, num_recommendations)
-    if "error" in collaborative_recs:
-        return content_based_recommend(user_id, num_recommendations)
-
-    collaborative_scores = {rec['eventId']: rec['Normalized Score'] for rec in collaborative_recs}
-    content_recs = content_based_recommend(user_id, num_recommendations)
-    content_scores = {rec['eventId']: rec['Normalized Score'] for rec in content_recs}
+# Shared pool for the hybrid sub-recommenders; their heavy parts run in NumPy/SciPy outside the GIL
+recommender_pool = ThreadPoolExecutor(max_workers=int(os.environ.get('RECOMMENDER_THREADS', 4)))
 
-    combined_scores = {}
-    for event_id in set(collaborative_scores.keys()).union(content_scores.keys()):
-        combined_scores[event_id] = (
-            0.8 * collaborative_scores.get(event_id, 0) +
-            0.2 * content_scores.get(event_id, 0)
-        )
+def timed(func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - started
 
-    top_events = sorted(combined_scores.items(), key=lambda x: x[1], reverse=True)[:num_recommendations]
-    events_df = fetch_events_data()
-    events_df = pd.DataFrame(events_df)
-    recommended_events = events_df[events_df['eventId'].isin(dict(top_events).keys())][['eventId', 'title']].copy()
-    recommended_events['Score'] = [combined_scores[event_id] for event_id in recommended_events['eventId']]
+def hybrid_recommendation(user_id, num_recommendations=20, debug=False):
+    """Combines collaborative and content-based recommendations.
 
-    return recommended_events.sort_values('Score', ascending=False).to_dict(orient='records')
+    Both scorers share one data snapshot and run concurrently. With debug=True
+    the result is returned with per-stage timings in seconds.
+    """
+    started = time.perf_counter()
+    snapshot, load_seconds = timed(load_recommendation_snapshot)
+    collaborative_future = recommender_pool.submit(
+        timed, collaborative_recommend, user_id, num_recommendations, snapshot)
+    content_future = recommender_pool.submit(
+        timed, content_based_recommend, user_id, num_recommendations, snapshot)
+    collaborative_recs, collaborative_seconds = collaborative_future.result()
+    content_recs, content_seconds = content_future.result()
+
+    combine_started = time.perf_counter()
+    if "error" in collaborative_recs:
+        recommendations = content_recs
+    else:
+        collaborative_scores = {rec['eventId']: rec['Score'] for rec in collaborative_recs}
+        content_scores = {rec['eventId']: rec['Score'] for rec in content_recs}
+
+        combined_scores = {}
+        for event_id in set(collaborative_scores.keys()).union(content_scores.keys()):
+            combined_scores[event_id] = (
+                0.8 * collaborative_scores.get(event_id, 0) +
+                0.2 * content_scores.get(event_id, 0)
+            )
+
+        top_events = sorted(combined_scores.items(), key=lambda x: x[1], reverse=True)[:num_recommendations]
+        events_df = snapshot['events_df']
+        recommended_events = events_df[events_df['eventId'].isin(dict(top_events).keys())][['eventId', 'title']].copy()
+        recommended_events['Score'] = [combined_scores[event_id] for event_id in recommended_events['eventId']]
+        recommendations = recommended_events.sort_values('Score', ascending=False).to_dict(orient='records')
+
+    if not debug:
+        return recommendations
+    return {
+        'recommendations': recommendations,
+        'timings': {
+            'load': load_seconds,
+            'collaborative': collaborative_seconds,
+            'content': content_seconds,
+            'combine': time.perf_counter() - combine_started,
+            'total': time.perf_counter() - started,
+        },
+    }
 
 def get_upcoming_events(events_df):
     """Filters and returns upcoming events based on the 'Status' column."""
@@ -273,388 +345,220 @@ def get_historical_events(events_df):
     """Filters and returns historical events based on the 'Status' column."""
     return [event for event in events_df if event['status'] != 'upcoming']
 
-def calculate_user_similarity(interactions_df):
+def get_similar_users(user_id, neighbour_index, top_n=5):
     """
-    Calculate the cosine similarity between users based on their event interactions.
+    Get the most similar users to the given user from the top-k neighbour index.
     """
-    # Create a user-event matrix (rows: users, columns: events)
-    user_event_matrix = interactions_df.pivot_table(index='userId', columns='eventId', aggfunc='size', fill_value=0)
-    
-    # Calculate cosine similarity between users
-    similarity_matrix = cosine_similarity(user_event_matrix)
-    
-    # Convert similarity matrix to DataFrame for easy lookup
-    similarity_df = pd.DataFrame(similarity_matrix, index=user_event_matrix.index, columns=user_event_matrix.index)
-    return similarity_df
+    return neighbour_index.similar_users(user_id, top_n)
+
+# Batch Recommendation Functions
+def batch_content_scores(user_ids, events, users, num_recommendations):
+    """Scores every requested user against the event index with one sparse product."""
+    content_index = event_index.ensure(events, prepare_event_content)
+    users_df = pd.DataFrame(users)
+    users_df = users_df[users_df['User ID'].isin(user_ids)].drop_duplicates('User ID')
+    results = {user_id: {} for user_id in user_ids}
+    if users_df.empty:
+        return results
+
+    user_features = users_df['preference'].fillna('').astype(str) + ' ' + \
+                    users_df['skills'].fillna('').astype(str) + ' ' + \
+                    users_df['location'].fillna('').astype(str)
+    scores = content_index.score(content_index.transform(user_features))
+    top = top_k_indices(scores, num_recommendations)
+
+    for row, user_id in enumerate(users_df['User ID']):
+        if scores[row].sum() == 0:
+            continue
+        top_scores = normalize_scores(scores[row, top[row]].tolist())
+        results[user_id] = {content_index.event_ids[col]: score for col, score in zip(top[row], top_scores)}
+    return results
+
+def batch_collaborative_scores(user_ids, upcoming_events, titles, num_recommendations):
+    """Sums every requested user's KNN neighbours' interactions with one sparse product."""
+    results = {user_id: {} for user_id in user_ids}
+    upcoming_ids = [event['eventId'] for event in upcoming_events]
+    current_interaction_matrix(upcoming_ids)  # brings the store up to date when the live listener is not ready
+    knn, interaction_matrix, matrix_user_ids, event_ids = user_search.get(interaction_store, upcoming_ids)
+    if interaction_matrix.nnz == 0:
+        return results
+
+    row_of = {user_id: row for row, user_id in enumerate(matrix_user_ids)}
+    known_users = [user_id for user_id in dict.fromkeys(user_ids) if user_id in row_of]
+    if not known_users:
+        return results
+
+    n_neighbors = min(num_recommendations, interaction_matrix.shape[0])
+    _, indices = knn.kneighbors(interaction_matrix[[row_of[user_id] for user_id in known_users]], n_neighbors)
+
+    # Batch x users neighbour indicator, so one product sums all neighbour rows
+    neighbours = csr_matrix(
+        (np.ones(indices.size), (np.repeat(np.arange(len(known_users)), indices.shape[1]), indices.ravel())),
+        shape=(len(known_users), interaction_matrix.shape[0])
+    )
+    scores = (neighbours @ interaction_matrix).toarray()
+    # Same ranking as collaborative_recommend: score, then where the neighbour scan first meets the event
+    top = top_k_by_scan_order(scores, neighbour_scan_order(interaction_matrix, indices), num_recommendations)
+
+    for row, user_id in enumerate(known_users):
+        picked = [col for col in top[row] if event_ids[col] in titles]
+        if not picked:
+            continue
+        top_scores = normalize_scores(scores[row, picked].tolist())
+        if max(top_scores) < 0.1:
+            continue
+        results[user_id] = {event_ids[col]: score for col, score in zip(picked, top_scores)}
+    return results
+
+def format_recommendations(scores, titles, num_recommendations):
+    top_events = sorted(scores.items(), key=lambda x: x[1], reverse=True)[:num_recommendations]
+    return [{'eventId': event_id, 'title': titles.get(event_id), 'Score': score} for event_id, score in top_events]
+
+def batch_recommend(user_ids, num_recommendations=20, method='hybrid'):
+    """Recommends for many users in one pass; method is 'content', 'collaborative' or 'hybrid'."""
+    started = time.perf_counter()
+    events = fetch_events_data()
+    upcoming_events = get_upcoming_events(events)
+    titles = {event['eventId']: event.get('title') for event in events}
+
+    content_scores = {}
+    collaborative_scores = {}
+    if method in ('content', 'hybrid'):
+        content_scores = batch_content_scores(user_ids, events, fetch_users_data(), num_recommendations)
+    if method in ('collaborative', 'hybrid'):
+        collaborative_scores = batch_collaborative_scores(user_ids, upcoming_events, titles, num_recommendations)
+
+    results = {}
+    for user_id in user_ids:
+        if method == 'content':
+            scores = content_scores[user_id]
+        elif method == 'collaborative':
+            scores = collaborative_scores[user_id]
+        else:
+            scores = {}
+            for event_id in set(collaborative_scores[user_id]).union(content_scores[user_id]):
+                scores[event_id] = (
+                    0.8 * collaborative_scores[user_id].get(event_id, 0) +
+                    0.2 * content_scores[user_id].get(event_id, 0)
+                )
+        results[user_id] = format_recommendations(scores, titles, num_recommendations)
+
+    elapsed = time.perf_counter() - started
+    return {
+        'results': results,
+        'elapsed_seconds': elapsed,
+        'users_per_second': len(user_ids) / elapsed if elapsed > 0 else None,
+    }
 
-def get_similar_users(user_id, similarity_df, top_n=5):
-    """
-    Get the most similar users to the given user based on the similarity matrix.
-    """
-    similar_users = similarity_df[user_id].sort_values(ascending=False).iloc[1:top_n+1]
-    return similar_users.index.tolist()
+# Top-N lists materialised by precompute_recs.py; live scoring is only the fallback for cold users
+recommendation_store = RecommendationStore(
+    'data/recommendations.db',
+    max_age_seconds=float(os.environ.get('PRECOMPUTED_MAX_AGE', 24 * 3600))
+)
+
+def serve_recommendations(user_id, method, num_recommendations, live_recommend):
+    precomputed = recommendation_store.get(user_id, method, num_recommendations)
+    if precomputed is not None:
+        return precomputed
+    return live_recommend()
 
 # Flask API Routes
 @app.route('/recommend', methods=['GET'])
 def recommend_route():
     user_id = request.args.get('user_id')
     num_recommendations = int(request.args.get('n', 5))
-    return jsonify(content_based_recommend(user_id, num_recommendations))
+    return jsonify(serve_recommendations(user_id, 'content', num_recommendations,
+                                         lambda: content_based_recommend(user_id, num_recommendations)))
 
 @app.route('/collaborative_recommend', methods=['GET'])
 def collaborative_recommend_route():
     user_id = request.args.get('user_id')
     num_recommendations = int(request.args.get('n', 5))
-    return jsonify(collaborative_recommend(user_id, num_recommendations))
+    return jsonify(serve_recommendations(user_id, 'collaborative', num_recommendations,
+                                         lambda: collaborative_recommend(user_id, num_recommendations)))
 
 @app.route('/popularity_recommend', methods=['GET'])
 def popularity_recommend_route():
     num_recommendations = int(request.args.get('n', 5))
-    return jsonify(popularity_based_recommendation(num_recommendations))
+    return jsonify(serve_recommendations(POPULARITY_KEY, 'popularity', num_recommendations,
+                                         lambda: popularity_based_recommendation(num_recommendations)))
 
 @app.route('/hybrid_recommend', methods=['GET'])
 def hybrid_recommend_route():
     user_id = request.args.get('user_id')
     num_recommendations = int(request.args.get('n', 5))
-    return jsonify(hybrid_recommendation(user_id, num_recommendations))
-
-def extract_face_embedding(image):
-    embedding = DeepFace.represent(image, model_name="VGG-Face", enforce_detection=False)
-    if embedding:
-        return embedding[0]['embedding']
-    return None
-
-def detect_face_using_opencv(image):
-    face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-
-    # Convert the image to grayscale for better face detection
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-
-    # Detect faces
-    faces = face_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(30, 30))
-
-    return faces
-
-def is_valid_face(face_image):
-    if face_image.shape[0] < 50 or face_image.shape[1] < 50:
-        return False
-    return True
-
-@app.route('/start_capture', methods=['POST'])
-def start_capture():
-    global faces_data, names_data
-
-    try:
-        if 'image0' not in request.files:
-            return jsonify({'success': False, 'message': 'No images uploaded'}), 400
-
-        name = request.form.get('email')  
-        files = [file for key, file in request.files.items()]
-
-        faces_data = []
-        names_data = []
-
-        names_file_path = 'data/names_data.pkl'
-        if os.path.exists(names_file_path):
-            with open(names_file_path, 'rb') as f:
-                existing_names = pickle.load(f)
-                print(existing_names)
-            if name in existing_names:
-                return jsonify({'success': False, 'message': f"The email - '{name}' already exists. Please use a different email."}), 400
-
-        valid_faces_count = 0
-
-        for file in files:
-            file_bytes = np.frombuffer(file.read(), np.uint8)
-            img = cv2.imdecode(file_bytes, cv2.IMREAD_COLOR)
-
-            if img is None:
-                return jsonify({'success': False, 'message': 'Invalid image file'}), 400
-
-            faces_opencv = detect_face_using_opencv(img)
-            if len(faces_opencv) == 0:
-                print("Step 1")
-                continue  
-
-            try:
-                faces = DeepFace.extract_faces(img, enforce_detection=False)
-
-                if len(faces) == 0:
-                    continue  
-                elif len(faces) > 1:
-                    print("Multiple faces detected in an image. Skipping this image...")
-                    continue  
-                for face in faces:
-                    face_image = face['face']
-
-                    if not is_valid_face(face_image):
-                        print("Step 3")
-                        continue  
-
-                    face_embedding = extract_face_embedding(face_image)
-                    if face_embedding is None:
-                        print("Step 4")
-                        continue  # Skip if embedding extraction failed
-
-                    faces_data.append(face_embedding)
-                    names_data.append(name) 
-                    
-                    valid_faces_count += 1
-                print('valid face',valid_faces_count)
-            except Exception as e:
-                return jsonify({'success': False, 'message': f'Error during face detection: {str(e)}'}), 500
-
-        if valid_faces_count < 4:
-            return jsonify({'success': False, 'message': 'Insufficient valid faces detected. Please upload more images with clear faces.'}), 400
-
-        return jsonify({'success': True, 'message': 'Faces data captured successfully'})
-
-    except Exception as e:
-        return jsonify({'success': False, 'message': str(e)}), 500
-
-@app.route('/edit_face_data', methods=['POST'])
-def edit_face_data():
-    global faces_data, names_data
-
-    try:
-        if 'image0' not in request.files:
-            return jsonify({'success': False, 'message': 'No images uploaded'}), 400
-
-        name = request.form.get('email')  # Retrieve the name
-        files = [file for key, file in request.files.items()]
-
-        # Clear the previous faces_data and names_data
-        faces_data = []
-        names_data = []
-
-        # Validate if name already exists
-        names_file_path = 'data/names_data.pkl'
-        if os.path.exists(names_file_path):
-            with open(names_file_path, 'rb') as f:
-                existing_names = pickle.load(f)
-            if name not in existing_names:
-                return jsonify({'success': False, 'message': f"The email - '{name}' does not exist. Please contact admin."}), 400
-
-        # Track the number of valid faces
-        valid_faces_count = 0
-
-        for file in files:
-            file_bytes = np.frombuffer(file.read(), np.uint8)
-            img = cv2.imdecode(file_bytes, cv2.IMREAD_COLOR)
-
-            if img is None:
-                return jsonify({'success': False, 'message': 'Invalid image file'}), 400
-
-            # Step 1: Detect faces using OpenCV
-            faces_opencv = detect_face_using_opencv(img)
-            if len(faces_opencv) == 0:
-                print("Step 1")
-                continue  # No face detected, skip this image
-
-            try:
-                # Step 2: Extract faces using DeepFace
-                faces = DeepFace.extract_faces(img, enforce_detection=False)
-
-                if len(faces) == 0:
-                    continue  # No face detected after DeepFace extraction, skip this image
-                elif len(faces) > 1:
-                    print("Multiple faces detected in an image. Skipping this image...")
-                    continue  # Skip images with multiple faces
-
-                for face in faces:
-                    face_image = face['face']
-                    if face_image.dtype == np.float64:
-                        face_image = (face_image * 255).astype(np.uint8)
-
-                    # Step 3: Check if the face is valid (face size and properties)
-                    if not is_valid_face(face_image):
-                        print("Step 3")
-                        continue  # Skip invalid face (too small)
-
-                    # Extract the face embedding and store it
-                    face_embedding = extract_face_embedding(face_image)
-                    if face_embedding is None:
-                        print("Step 4")
-                        continue  # Skip if embedding extraction failed
-
-                    faces_data.append(face_embedding)
-                    names_data.append(name)  # Store the name corresponding to the face
-
-                    # Increment the valid face count
-                    valid_faces_count += 1
-                    print(valid_faces_count)
-            except Exception as e:
-                return jsonify({'success': False, 'message': 'Error during face detection'}), 500
-
-        # If less than 8 valid faces are detected, return an error
-        if valid_faces_count < 4:
-            return jsonify({'success': False, 'message': 'Please make sure to follow the guidelines for face data collecting!'}), 400
-
-        # Return success after storing enough valid data
-        return jsonify({'success': True, 'message': 'Faces data captured successfully'})
-
-    except Exception as e:
-        return jsonify({'success': False, 'message': str(e)}), 500
-
-@app.route('/register', methods=['POST'])
-def register():
-    global faces_data, names_data
-
-    try:
-        if not faces_data or not names_data:
-            return jsonify({'success': False, 'message': 'No data captured please add the face follow by guild'}), 400
-
-        # Save face data and names
-        save_face_data(np.array(faces_data), names_data)
-
-        # Train and save the updated KNN model
-        train_knn_model()
-
-        return jsonify({'success': True, 'message': 'Face registered successfully !'})
-
-    except Exception as e:
-        return jsonify({'success': False, 'message': str(e)}), 500
-
-#edit face data
-@app.route('/confirmEditFace', methods=['POST'])
-def confirm_edit_face():
-    global faces_data, names_data
-
-    try:
-        if not faces_data or not names_data:
-            return jsonify({'success': True, 'message': 'No face data to update, success.'}), 200
-
-        # email = request.form.get('email')  # Get the email from the request
-        email = request.json.get('email')
-        if not email:
-            return jsonify({'success': False, 'message': 'Email is required'}), 400
-
-        # Paths to pickle files
-        face_file_path = 'data/faces_data.pkl'
-        name_file_path = 'data/names_data.pkl'
-
-        # Load existing data
-        existing_faces = []
-        existing_names = []
-        if os.path.exists(face_file_path) and os.path.exists(name_file_path):
-            with open(face_file_path, 'rb') as f:
-                existing_faces = pickle.load(f)
-            with open(name_file_path, 'rb') as f:
-                existing_names = pickle.load(f)
-
-        # Ensure email exists in the data
-        if email not in existing_names:
-            return jsonify({'success': False, 'message': f"No data found for email: {email}"}), 400
-
-        # Remove old data for the email
-        indices_to_keep = [i for i, name in enumerate(existing_names) if name != email]
-        updated_faces = [existing_faces[i] for i in indices_to_keep]
-        updated_names = [existing_names[i] for i in indices_to_keep]
-
-        # Add new data (captured in memory)
-        updated_faces.extend(faces_data)  # Add new face embeddings
-        updated_names.extend(names_data)  # Add corresponding names
-
-        # Save updated data back to pickle files
-        with open(face_file_path, 'wb') as f:
-            pickle.dump(updated_faces, f)
-        with open(name_file_path, 'wb') as f:
-            pickle.dump(updated_names, f)
-
-        # Train and save the updated KNN model
-        train_knn_model()
-
-        return jsonify({'success': True, 'message': 'Face data updated successfully !'})
-
-    except Exception as e:
-        return jsonify({'success': False, 'message': str(e)}), 500
-
-@app.route('/mark_attendance', methods=['POST'])
-def mark_attendance():
-    global knn
-
-    if knn is None:
-        return jsonify({'success': False, 'message': 'Error during mark attendance please contact the organization !'}), 500
-
-    try:
-        file = request.files['image']
-        file_bytes = np.frombuffer(file.read(), np.uint8)
-        uploaded_image = cv2.imdecode(file_bytes, cv2.IMREAD_COLOR)
-
-        faces = DeepFace.extract_faces(uploaded_image, enforce_detection=False)
-        if len(faces) != 1:
-            return jsonify({'success': False, 'message': 'Please provide snap with exactly one face.'}), 400
-
-        face_image = faces[0]['face']
-        if face_image.dtype == np.float64:
-            face_image = (face_image * 255).astype(np.uint8)
-        face_embedding = extract_face_embedding(face_image)
-
-        predicted_label = knn.predict([face_embedding])
-        distances, indices = knn.kneighbors([face_embedding])
-        min_distance = distances[0][0]
-        print(min_distance)
-        threshold = 0.57
-        if min_distance < threshold:
-            predicted_name = predicted_label[0]
-            return jsonify({'success': True, 'message': f"Attendance marked successfully for {predicted_name}!"})
-        else:
-            return jsonify({'success': False, 'message': 'Face not recognized. Distance too large.'}), 400
-
-    except Exception as e:
-        return jsonify({'success': False, 'message': str(e)}), 500
-
-def save_face_data(faces_data, names_data):
-    faces_file_path = 'data/faces_data.pkl'
-    names_file_path = 'data/names_data.pkl'
-
-    if os.path.exists(faces_file_path) and os.path.exists(names_file_path):
-        with open(faces_file_path, 'rb') as f:
-            existing_faces = pickle.load(f)
-        with open(names_file_path, 'rb') as f:
-            existing_names = pickle.load(f)
-
-        existing_faces = np.concatenate((existing_faces, faces_data), axis=0)
-        existing_names.extend(names_data)
-    else:
-        existing_faces = faces_data
-        existing_names = names_data
-
-    with open(faces_file_path, 'wb') as f:
-        pickle.dump(existing_faces, f)
-    with open(names_file_path, 'wb') as f:
-        pickle.dump(existing_names, f)
-
-    print("✅ Face data and names stored successfully.")
-
-def train_knn_model():
-    global knn
-
-    try:
-        with open('data/faces_data.pkl', 'rb') as f:
-            faces = pickle.load(f)
-        with open('data/names_data.pkl', 'rb') as f:
-            labels = pickle.load(f)
-
-        knn = KNeighborsClassifier(n_neighbors=5)
-        knn.fit(faces, labels)
-
-        with open('data/faces_knn.pkl', 'wb') as f:
-            pickle.dump(knn, f)
-
-        print("✅ KNN model trained and saved successfully.")
-
-    except Exception as e:
-        print(f"Error during KNN training: {e}")
+    if request.args.get('debug') in ('1', 'true'):
+        return jsonify(hybrid_recommendation(user_id, num_recommendations, debug=True))
+    return jsonify(serve_recommendations(user_id, 'hybrid', num_recommendations,
+                                         lambda: hybrid_recommendation(user_id, num_recommendations)))
+
+@app.route('/cache_stats', methods=['GET'])
+def cache_stats_route():
+    stats = snapshot_cache.stats()
+    stats['live'] = {
+        name: {'ready': live.ready.is_set(), 'size': len(live), 'version': live.version}
+        for name, live in live_collections.items()
+    }
+    return jsonify(stats)
+
+@app.route('/invalidate_cache', methods=['POST'])
+def invalidate_cache_route():
+    collection = request.args.get('collection')
+    snapshot_cache.invalidate(collection)
+    return jsonify({'success': True, 'message': f"Cache invalidated for {collection or 'all collections'}"})
+
+@app.route('/batch_recommend', methods=['POST'])
+def batch_recommend_route():
+    payload = request.get_json(silent=True) or {}
+    user_ids = payload.get('user_ids')
+    if not isinstance(user_ids, list) or not user_ids:
+        return jsonify({'error': 'user_ids must be a non-empty list'}), 400
+    method = payload.get('method', 'hybrid')
+    if method not in ('content', 'collaborative', 'hybrid'):
+        return jsonify({'error': f"Unknown method: {method}"}), 400
+    num_recommendations = int(payload.get('n', 5))
+    return jsonify(batch_recommend(user_ids, num_recommendations, method))
+
+def event_participant_emails(event_id):
+    """Emails of the volunteers with an 'apply' interaction for event_id."""
+    interactions = fetch_interactions_data()
+    users = fetch_users_data()
+    for data in (interactions, users):
+        if isinstance(data, dict) and 'error' in data:
+            raise RuntimeError(data['error'])
+    applicants = {row.get('userId') for row in interactions
+                  if row.get('eventId') == event_id and row.get('type') == 'apply'}
+    return [user['email'] for user in users if user.get('User ID') in applicants and user.get('email')]
+
+def _invalidate_event_galleries(deltas):
+    # A new or withdrawn application changes who can check in to that event
+    for _, _, data in deltas:
+        if data and data.get('type') == 'apply':
+            face_routes.event_galleries.invalidate(data.get('eventId'))
+
+def start_live_collections():
+    if 'Interactions' in live_collections:
+        live_collections['Interactions'].add_listener(_invalidate_event_galleries)
+    for live in live_collections.values():
+        live.start()
+
+def start_services():
+    """Starts the Firestore listeners and the face services (see face_routes.py) once per server process.
+
+    Runs under __main__ and before the first request rather than on import:
+    precompute_recs.py imports this module, and so do the spawned face
+    workers, and neither should start any of it.
+    """
+    face_routes.start_services(resolve_participants=event_participant_emails, on_start=start_live_collections)
 
-# Load the KNN model at startup
-try:
-    with open('data/faces_knn.pkl', 'rb') as f:
-        knn = pickle.load(f)
-    print("✅ KNN model loaded successfully.")
-except FileNotFoundError:
-    print("⚠️ No KNN model found. Train the model first by registering users.")
+@app.before_request
+def ensure_services():
+    start_services()
 
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    # The debug reloader runs this block in a watcher process as well; only the serving
+    # child (WERKZEUG_RUN_MAIN) starts the services, and the data files they write are not watched
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_services()
+    app.run(host='0.0.0.0', port=5000, debug=True, exclude_patterns=['*/data/*'])
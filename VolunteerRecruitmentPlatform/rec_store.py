@@ -0,0 +1,108 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+POPULARITY_KEY = '*'
+
+
+def write_recommendations(path, rows, top_n, built_at=None):
+    """Writes (user_id, method, recommendations) rows to a fresh SQLite file and swaps it in atomically.
+
+    Only non-empty lists are stored: an empty list (a user with nothing to go
+    on yet) or an error dict is left out, so the server scores that user live.
+    Returns how many lists were stored.
+    """
+    built_at = built_at or time.time()
+    tmp_path = path + '.tmp'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    conn = sqlite3.connect(tmp_path)
+    try:
+        conn.execute('CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)')
+        conn.execute(
+            'CREATE TABLE recommendations ('
+            'user_id TEXT, method TEXT, payload TEXT, built_at REAL, '
+            'PRIMARY KEY (user_id, method))'
+        )
+        count = 0
+        for user_id, method, recommendations in rows:
+            if not isinstance(recommendations, list) or not recommendations:
+                continue
+            conn.execute(
+                'INSERT OR REPLACE INTO recommendations VALUES (?, ?, ?, ?)',
+                (user_id, method, json.dumps(recommendations), built_at)
+            )
+            count += 1
+        conn.execute('INSERT INTO meta VALUES (?, ?)', ('built_at', str(built_at)))
+        conn.execute('INSERT INTO meta VALUES (?, ?)', ('top_n', str(top_n)))
+        conn.commit()
+    finally:
+        conn.close()
+
+    os.replace(tmp_path, path)
+    return count
+
+
+class RecommendationStore:
+    """Read side of the precomputed top-N recommendations written by precompute_recs.py.
+
+    The SQLite file is loaded into a dict so lookups are a single dict access;
+    the file is re-read when precompute_recs.py swaps in a new build.
+    """
+
+    def __init__(self, path='data/recommendations.db', max_age_seconds=24 * 3600, check_interval=5):
+        self.path = path
+        self.max_age_seconds = max_age_seconds
+        self.check_interval = check_interval
+        self.built_at = None
+        self.top_n = 0
+        self._entries = {}
+        self._mtime = None
+        self._checked_at = float('-inf')
+        self._lock = threading.Lock()
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return
+        with self._lock:
+            if now - self._checked_at < self.check_interval:
+                return
+            self._checked_at = now
+            try:
+                mtime = os.stat(self.path).st_mtime_ns
+            except FileNotFoundError:
+                self._entries, self._mtime, self.built_at, self.top_n = {}, None, None, 0
+                return
+            if mtime == self._mtime:
+                return
+
+            conn = sqlite3.connect(self.path)
+            try:
+                entries = {
+                    (user_id, method): json.loads(payload)
+                    for user_id, method, payload in conn.execute(
+                        'SELECT user_id, method, payload FROM recommendations')
+                }
+                meta = dict(conn.execute('SELECT key, value FROM meta'))
+            finally:
+                conn.close()
+            self._entries, self._mtime = entries, mtime
+            self.built_at, self.top_n = float(meta['built_at']), int(meta['top_n'])
+            print(f"✅ Loaded {len(entries)} precomputed recommendation lists.")
+
+    def get(self, user_id, method, num_recommendations):
+        """Returns the stored top list cut to num_recommendations, or None if missing, empty or stale."""
+        self._maybe_reload()
+        if self.built_at is None or time.time() - self.built_at > self.max_age_seconds:
+            return None
+        if num_recommendations > self.top_n:
+            return None
+        recommendations = self._entries.get((user_id, method))
+        # Builds before empty lists were skipped stored them too; score those users live
+        if not isinstance(recommendations, list) or not recommendations:
+            return None
+        return recommendations[:num_recommendations]
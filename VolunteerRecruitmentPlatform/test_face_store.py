@@ -0,0 +1,122 @@
+import os
+
+import numpy as np
+import pytest
+
+from face_index import FaceIndex, l2_normalise
+from face_store import FaceEmbeddingStore
+
+
+def faces(count, dim=16, seed=0):
+    return l2_normalise(np.random.default_rng(seed).normal(size=(count, dim))).astype(np.float32)
+
+
+def contents(store):
+    vectors, labels = store.live_embeddings()
+    return {label: vectors[[i for i, other in enumerate(labels) if other == label]] for label in set(labels)}
+
+
+def assert_same_contents(a, b):
+    a, b = contents(a), contents(b)
+    assert set(a) == set(b)
+    for label in a:
+        np.testing.assert_array_equal(a[label], b[label])
+
+
+def test_compaction_keeps_only_the_live_rows(tmp_path):
+    store = FaceEmbeddingStore(str(tmp_path))
+    store.add(faces(4, seed=1), ['a'] * 4)
+    store.add(faces(4, seed=2), ['b'] * 4)
+    store.add(faces(4, seed=3), ['c'] * 4)
+    store.replace('a', faces(3, seed=4))
+    store.remove('b')
+    before = contents(store)
+
+    store.compact()
+
+    assert store.generation == 1
+    assert len(store.labels) == len(store) == 7
+    assert not {'embeddings-0.f32', 'log-0.jsonl'} & set(os.listdir(tmp_path))
+    after = contents(store)
+    assert set(after) == set(before) == {'a', 'c'}
+    for label in before:
+        np.testing.assert_array_equal(after[label], before[label])
+    np.testing.assert_array_equal(store.embeddings_of('a'), faces(3, seed=4))
+
+    # A fresh open replays the compacted generation
+    assert_same_contents(FaceEmbeddingStore(str(tmp_path)), store)
+
+
+def test_compacts_itself_once_most_rows_are_dead(tmp_path):
+    store = FaceEmbeddingStore(str(tmp_path), compact_ratio=0.5, min_compact_rows=8)
+    store.add(faces(6, seed=1), ['a'] * 6)
+    store.add(faces(2, seed=2), ['b'] * 2)
+    store.replace('a', faces(1, seed=3))
+
+    assert store.generation == 1
+    assert len(store.labels) == 3
+    np.testing.assert_array_equal(store.embeddings_of('a'), faces(1, seed=3))
+
+
+def test_writes_reach_another_instance(tmp_path):
+    writer = FaceEmbeddingStore(str(tmp_path))
+    reader = FaceEmbeddingStore(str(tmp_path))
+
+    writer.add(faces(4, seed=1), ['a'] * 4)
+    assert 'a' in reader
+    np.testing.assert_array_equal(reader.embeddings_of('a'), faces(4, seed=1))
+
+    reader.add(faces(2, seed=2), ['b'] * 2)
+    writer.replace('a', faces(3, seed=3))
+    assert_same_contents(reader, writer)
+    assert reader.version == writer.version
+
+
+def test_compaction_reaches_another_instance(tmp_path):
+    writer = FaceEmbeddingStore(str(tmp_path))
+    reader = FaceEmbeddingStore(str(tmp_path))
+    writer.add(faces(4, seed=1), ['a'] * 4)
+    writer.add(faces(4, seed=2), ['b'] * 4)
+    old_version = reader.version
+    writer.remove('a')
+    writer.compact()
+
+    # The reader's log position is gone: it is told to reload a snapshot
+    version, records = reader.changes_since(old_version)
+    assert records is None
+    assert version == writer.version
+    assert reader.generation == 1
+    assert_same_contents(reader, writer)
+
+    # And keeps following the new generation
+    writer.add(faces(2, seed=3), ['c'] * 2)
+    version, records = reader.changes_since(version)
+    assert [record['op'] for record in records] == ['add']
+    np.testing.assert_array_equal(records[0]['embeddings'], faces(2, seed=3))
+
+
+def test_face_index_syncs_from_another_instance(tmp_path):
+    writer = FaceEmbeddingStore(str(tmp_path))
+    reader = FaceEmbeddingStore(str(tmp_path))
+    index = FaceIndex(n_neighbors=1)
+    a, b = faces(4, seed=1), faces(4, seed=2)
+
+    writer.add(a, ['a'] * 4)
+    assert index.sync(reader)
+    assert index.recognise(a[0])['label'] == 'a'
+
+    writer.add(b, ['b'] * 4)
+    writer.remove('a')
+    assert index.sync(reader)
+    assert len(index) == 4
+    assert index.recognise(a[0])['label'] == 'b'
+    assert not index.sync(reader)
+
+    writer.compact()
+    writer.replace('b', a)
+    assert index.sync(reader)
+    assert index.store_version == writer.version
+    assert len(index) == 4
+    match = index.recognise(a[0])
+    assert match['label'] == 'b'
+    assert match['distance'] == pytest.approx(0.0, abs=1e-3)
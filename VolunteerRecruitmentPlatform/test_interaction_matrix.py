@@ -0,0 +1,187 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+from scipy.sparse import csr_matrix, random as sparse_random
+
+from interaction_matrix import (INTERACTION_WEIGHTS, InteractionMatrix, UserNeighbourIndex, aggregate_neighbour_scores,
+                                neighbour_scan_order, top_k_by_scan_order)
+
+
+def make_interactions(count, users=40, events=30, seed=0):
+    rng = np.random.default_rng(seed)
+    now = datetime.now()
+    types = list(INTERACTION_WEIGHTS)
+    return [{
+        'User ID': f"i{i}",
+        'userId': f"u{rng.integers(users)}",
+        'eventId': f"e{rng.integers(events)}",
+        'type': types[rng.integers(len(types))],
+        'timestamp': (now - timedelta(days=float(rng.uniform(0, 20)))).isoformat(),
+    } for i in range(count)]
+
+
+def loaded(interactions):
+    store = InteractionMatrix(window_days=28)
+    store.load(interactions)
+    return store
+
+
+def assert_same_matrix(a, b):
+    matrix_a, users_a, events_a = a.matrix()
+    matrix_b, users_b, events_b = b.matrix()
+    assert users_a == users_b
+    assert events_a == events_b
+    np.testing.assert_allclose(matrix_a.toarray(), matrix_b.toarray())
+
+
+def test_incremental_changes_match_full_reload():
+    interactions = make_interactions(300)
+    store = loaded(interactions[:200])
+
+    added = interactions[200:]
+    modified = [{**row, 'type': 'apply'} for row in interactions[:20]]
+    removed = interactions[20:40]
+    store.apply_changes([('ADDED', row['User ID'], row) for row in added] +
+                        [('MODIFIED', row['User ID'], row) for row in modified] +
+                        [('REMOVED', row['User ID'], None) for row in removed])
+
+    final = modified + interactions[40:]
+    assert_same_matrix(store, loaded(final))
+
+
+def test_removing_every_interaction_of_a_user_drops_its_row():
+    interactions = make_interactions(200)
+    store = loaded(interactions)
+    gone = interactions[0]['userId']
+    store.apply_changes([('REMOVED', row['User ID'], None) for row in interactions if row['userId'] == gone])
+
+    assert gone not in store.matrix()[1]
+    assert_same_matrix(store, loaded([row for row in interactions if row['userId'] != gone]))
+
+
+def test_interactions_outside_the_window_are_ignored_and_expired():
+    interactions = make_interactions(200)
+    old = {**interactions[0], 'User ID': 'old', 'timestamp': (datetime.now() - timedelta(days=40)).isoformat()}
+    store = loaded(interactions)
+    store.apply_changes([('ADDED', 'old', old)])
+    assert_same_matrix(store, loaded(interactions))
+
+    # Ten days on, everything older than 18 days has left the window
+    later = datetime.now() + timedelta(days=10)
+    matrix, user_ids, event_ids = store.matrix(now=later)
+    cutoff = later - timedelta(days=28)
+    expected = loaded([row for row in interactions if datetime.fromisoformat(row['timestamp']) >= cutoff])
+    expected_matrix, expected_users, expected_events = expected.matrix()
+    assert user_ids == expected_users
+    np.testing.assert_allclose(matrix.toarray(), expected_matrix[:, [expected_events.index(e) for e in event_ids]]
+                               .toarray())
+
+
+def assert_same_neighbours(partial, full):
+    assert set(partial.neighbours) == set(full.neighbours)
+    for user_id, expected in full.neighbours.items():
+        got = partial.neighbours[user_id]
+        # Users tied at the k-th similarity may be listed in either order
+        np.testing.assert_allclose([sim for _, sim in got], [sim for _, sim in expected])
+        exact = dict(expected)
+        for neighbour_id, sim in got:
+            if neighbour_id in exact:
+                assert sim == pytest.approx(exact[neighbour_id])
+
+
+def test_partial_neighbour_refresh_matches_full_recompute(monkeypatch):
+    interactions = make_interactions(400, users=60, events=40)
+    store = loaded(interactions)
+    index = UserNeighbourIndex(k=5).refresh(store)
+
+    # A few users change: new events, a dropped interaction, and a brand new user
+    rng = np.random.default_rng(1)
+    now = datetime.now().isoformat()
+    deltas = [('ADDED', f"new{i}", {'userId': 'u3', 'eventId': f"e{rng.integers(40)}", 'type': 'view',
+                                    'timestamp': now}) for i in range(5)]
+    deltas += [('ADDED', 'fresh', {'userId': 'u999', 'eventId': 'e1', 'type': 'apply', 'timestamp': now})]
+    deltas += [('REMOVED', row['User ID'], None) for row in interactions if row['userId'] == 'u7'][:3]
+    store.apply_changes(deltas)
+    changed = store.changed_users(index._version)
+    assert 0 < len(changed) * 4 <= len(store.matrix()[1])  # small enough for the partial path
+
+    partial_refreshes = []
+    refresh_partial = index._refresh_partial
+    monkeypatch.setattr(index, '_refresh_partial', lambda *args: partial_refreshes.append(refresh_partial(*args)))
+    index.refresh(store)
+    assert len(partial_refreshes) == 1
+    assert_same_neighbours(index, UserNeighbourIndex(k=5).refresh(store))
+
+
+def test_neighbour_refresh_follows_a_removed_user():
+    interactions = make_interactions(400, users=60, events=40)
+    store = loaded(interactions)
+    index = UserNeighbourIndex(k=5).refresh(store)
+
+    store.apply_changes([('REMOVED', row['User ID'], None) for row in interactions if row['userId'] == 'u5'])
+    index.refresh(store)
+
+    assert 'u5' not in index.neighbours
+    assert all('u5' not in index.similar_users(user_id) for user_id in index.neighbours)
+    assert_same_neighbours(index, UserNeighbourIndex(k=5).refresh(store))
+
+
+def loop_scores(matrix, neighbour_rows):
+    """The per-neighbour, per-event loop collaborative_recommend used before aggregate_neighbour_scores."""
+    recommended_events = {}
+    for idx in neighbour_rows:
+        user_events = matrix[idx]
+        for col, score in zip(user_events.indices, user_events.data):
+            if score > 0:
+                recommended_events[col] = recommended_events.get(col, 0) + score
+    return recommended_events
+
+
+def loop_top(matrix, neighbour_rows, k):
+    return sorted(loop_scores(matrix, neighbour_rows).items(), key=lambda x: x[1], reverse=True)[:k]
+
+
+def weighted_matrix(users=200, events=50, seed=0):
+    # Interaction weights only, so sums are exact and many scores tie
+    matrix = sparse_random(users, events, density=0.1, format='csr', random_state=seed)
+    values = np.array(list(INTERACTION_WEIGHTS.values()), dtype=float)
+    matrix.data = values[np.random.default_rng(seed).integers(len(values), size=matrix.nnz)]
+    matrix.sort_indices()
+    return matrix
+
+
+@pytest.mark.parametrize('k', [1, 5, 20, 100])
+def test_vectorised_scores_match_the_loop(k):
+    matrix = weighted_matrix()
+    rng = np.random.default_rng(k)
+    for _ in range(20):
+        neighbour_rows = rng.integers(matrix.shape[0], size=8)
+        cols, scores = aggregate_neighbour_scores(matrix, neighbour_rows, k=k)
+        assert list(zip(cols.tolist(), scores.tolist())) == loop_top(matrix, neighbour_rows, k)
+
+
+def test_batch_scores_match_the_loop():
+    matrix = weighted_matrix(seed=1)
+    rng = np.random.default_rng(2)
+    indices = rng.integers(matrix.shape[0], size=(30, 6))
+
+    # Batch path of batch_collaborative_scores: one neighbour-count matrix times the interactions
+    neighbours = csr_matrix((np.ones(indices.size), (np.repeat(np.arange(len(indices)), indices.shape[1]),
+                                                      indices.ravel())), shape=(len(indices), matrix.shape[0]))
+    scores = (neighbours @ matrix).toarray()
+    top = top_k_by_scan_order(scores, neighbour_scan_order(matrix, indices), 10)
+
+    for row, neighbour_rows in enumerate(indices):
+        expected = loop_top(matrix, neighbour_rows, 10)
+        assert [(col, scores[row, col]) for col in top[row]] == expected
+
+
+def test_excluded_events_are_not_scored():
+    matrix = weighted_matrix(seed=3)
+    neighbour_rows = np.arange(10)
+    seen = matrix[0].indices
+    cols, _ = aggregate_neighbour_scores(matrix, neighbour_rows, exclude_cols=seen, k=10)
+    expected = [(col, score) for col, score in sorted(loop_scores(matrix, neighbour_rows).items(),
+                                                      key=lambda x: x[1], reverse=True) if col not in seen][:10]
+    assert cols.tolist() == [col for col, _ in expected]